@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Post, Group, Comment, Follow
+from .search import build_match, fts_available, matching_ids
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +9,13 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        # поиск по полнотекстовому индексу вместо LIKE '%...%'
+        match = build_match(search_term)
+        if not match or not fts_available():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=matching_ids(match)), False
+
 
 admin.site.register(Comment)
 admin.site.register(Follow)
@@ -0,0 +1,147 @@
+"""JSON для мобильных клиентов: те же ленты, что и в HTML, без шаблонов.
+
+Ответы собираются из строк values(), без создания объектов моделей.
+Клиент выбирает поля параметром ?fields=id,text,author; id нужен
+курсору и поэтому выбирается всегда.
+"""
+from django.core.files.storage import default_storage
+from django.http import Http404, JsonResponse
+
+from . import reference, usernames
+from .models import Comment, Post
+from .paginator import COMMENTS_PER_PAGE, CursorPaginator, paginate
+from .timeline import TimelinePaginator
+
+# публичное имя поля -> поле или путь для values()
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comment_count': 'comment_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'created': 'created',
+    'author': 'author__username',
+}
+
+
+class FieldError(ValueError):
+    pass
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _requested(request, available):
+    """Выбранные клиентом поля в порядке available."""
+    fields = request.GET.get('fields')
+    if not fields:
+        return list(available)
+    names = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = names - set(available)
+    if unknown:
+        raise FieldError('Неизвестные поля: %s' % ', '.join(sorted(unknown)))
+    return [name for name in available if name in names]
+
+
+def _post_rows(queryset, names):
+    """Запрос values() с полями для ответа и для курсора."""
+    if 'comment_count' in names:
+        queryset = queryset.with_comment_count()
+    lookups = {POST_FIELDS[name] for name in names} | {'id', 'pub_date'}
+    return queryset.values(*lookups)
+
+
+def _serialize(row, names, available):
+    item = {name: row[available[name]] for name in names}
+    if 'image' in item:
+        item['image'] = (default_storage.url(item['image'])
+                         if item['image'] else None)
+    return item
+
+
+def _page_response(request, paginator, names, available):
+    try:
+        page, _ = paginate(request, paginator)
+    except Http404 as error:
+        return _error(str(error), 404)
+    return JsonResponse({
+        'results': [_serialize(row, names, available) for row in page],
+        'next': ('%s?%s' % (request.path, page.next_query)
+                 if page.next_query else None),
+        'previous': ('%s?%s' % (request.path, page.previous_query)
+                     if page.previous_query else None),
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def _feed(request, queryset):
+    try:
+        names = _requested(request, POST_FIELDS)
+    except FieldError as error:
+        return _error(str(error), 400)
+    return _page_response(request, CursorPaginator(_post_rows(queryset, names)),
+                          names, POST_FIELDS)
+
+
+def index(request):
+    return _feed(request, Post.objects.all())
+
+
+def group_posts(request, slug):
+    group = reference.group(slug)
+    if group is None:
+        return _error('Группа не найдена', 404)
+    return _feed(request, Post.objects.filter(group_id=group.id))
+
+
+def profile(request, username):
+    author_id = usernames.user_id(username)
+    if author_id is None:
+        return _error('Автор не найден', 404)
+    return _feed(request, Post.objects.filter(author_id=author_id))
+
+
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return _error('Нужна авторизация', 403)
+    try:
+        names = _requested(request, POST_FIELDS)
+    except FieldError as error:
+        return _error(str(error), 400)
+    posts = _post_rows(Post.objects.all(), names)
+    return _page_response(request, TimelinePaginator(request.user, posts=posts),
+                          names, POST_FIELDS)
+
+
+def post_view(request, username, post_id):
+    try:
+        names = _requested(request, POST_FIELDS)
+    except FieldError as error:
+        return _error(str(error), 400)
+    row = (_post_rows(Post.objects.filter(
+        id=post_id, **usernames.lookup(username, 'author')), names).first())
+    if row is None:
+        return _error('Пост не найден', 404)
+    return JsonResponse(_serialize(row, names, POST_FIELDS),
+                        json_dumps_params={'ensure_ascii': False})
+
+
+def post_comments(request, username, post_id):
+    try:
+        names = _requested(request, COMMENT_FIELDS)
+    except FieldError as error:
+        return _error(str(error), 400)
+    lookups = {COMMENT_FIELDS[name] for name in names} | {'id', 'created'}
+    comments = (Comment.objects
+                .filter(post_id=post_id,
+                        **usernames.lookup(username, 'post__author'))
+                .values(*lookups))
+    return _page_response(request, CursorPaginator(
+        comments, COMMENTS_PER_PAGE, ordering=('created', 'id')),
+        names, COMMENT_FIELDS)
@@ -0,0 +1,13 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path('posts/', api.index, name='api_index'),
+    path('follow/', api.follow_index, name='api_follow_index'),
+    path('group/<slug:slug>/', api.group_posts, name='api_groups'),
+    path('<str:username>/', api.profile, name='api_profile'),
+    path('<str:username>/<int:post_id>/', api.post_view, name='api_post'),
+    path('<str:username>/<int:post_id>/comments/', api.post_comments,
+         name='api_post_comments'),
+]
@@ -0,0 +1,85 @@
+"""Граф подписок в кэше.
+
+Для каждого пользователя хранится множество авторов, на которых он
+подписан, а для автора — число подписчиков. Записи загружаются из базы
+при первом обращении и сбрасываются сигналами при подписке и отписке,
+поэтому проверки «подписан ли A на B» и счётчики обычно не требуют
+запросов к базе.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from . import generations
+from .models import Follow, UserCounters
+
+
+def _following_key(user_id):
+    return 'follow-graph:%s:following:%s' % (
+        generations.get(generations.FOLLOWS), user_id)
+
+
+def _followers_key(author_id, version=None):
+    if version is None:
+        version = generations.get(generations.FOLLOWS)
+    return 'follow-graph:%s:followers:%s' % (version, author_id)
+
+
+def following(user_id):
+    """Множество id авторов, на которых подписан пользователь."""
+    if user_id is None:
+        return frozenset()
+    key = _following_key(user_id)
+    authors = cache.get(key)
+    if authors is None:
+        authors = frozenset(Follow.objects.filter(user_id=user_id)
+                            .values_list('author_id', flat=True))
+        cache.set(key, authors, timeout=None)
+    return authors
+
+
+def is_following(user_id, author_id):
+    return author_id in following(user_id)
+
+
+def following_count(user_id):
+    return len(following(user_id))
+
+
+def follower_counts(author_ids):
+    """Число подписчиков каждого автора; промахи — одним запросом."""
+    version = generations.get(generations.FOLLOWS)
+    keys = {_followers_key(author_id, version): author_id
+            for author_id in author_ids}
+    found = cache.get_many(list(keys))
+    counts = {keys[key]: count for key, count in found.items()}
+    missing = [author_id for key, author_id in keys.items()
+               if key not in found]
+    if missing:
+        loaded = dict.fromkeys(missing, 0)
+        loaded.update(UserCounters.objects.filter(user_id__in=missing)
+                      .values_list('user_id', 'followers'))
+        cache.set_many({_followers_key(author_id, version): count
+                        for author_id, count in loaded.items()},
+                       timeout=None)
+        counts.update(loaded)
+    return counts
+
+
+def follower_count(author_id):
+    return follower_counts([author_id])[author_id]
+
+
+def forget(user_id, author_id):
+    """Сбрасывает записи пары после подписки или отписки.
+
+    Второй сброс после коммита нужен на случай, если параллельный запрос
+    успел загрузить старые данные до конца транзакции.
+    """
+    keys = [_following_key(user_id), _followers_key(author_id)]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def reset():
+    """Сбрасывает весь граф после массовых изменений подписок."""
+    generations.bump(generations.FOLLOWS)
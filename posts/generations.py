@@ -0,0 +1,106 @@
+"""Счётчики поколений для кэша лент.
+
+Каждая лента (общая, группы, автора) имеет номер поколения, который
+входит в ключ кэша её фрагментов. Изменение поста или комментария
+увеличивает номера затронутых лент, поэтому старые фрагменты просто
+перестают читаться и могут жить в кэше сколько угодно долго.
+"""
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+FEED = 'feed'
+GROUP = 'group'
+AUTHOR = 'author'
+POST = 'post'
+# граф подписок целиком (posts.follow_graph)
+FOLLOWS = 'follows'
+# справочные данные в памяти процессов (posts.reference)
+REFERENCE = 'reference'
+# любое изменение данных; по нему устаревает кэш страниц для гостей
+PAGES = 'pages'
+
+
+def _key(scope, ident=None):
+    if ident is None:
+        return 'generation:%s' % scope
+    return 'generation:%s:%s' % (scope, ident)
+
+
+def _initial():
+    # после очистки кэша номер не должен повториться
+    return int(time.time() * 1000)
+
+
+def get(scope, ident=None):
+    key = _key(scope, ident)
+    value = cache.get(key)
+    if value is None:
+        value = _initial()
+        if not cache.add(key, value, timeout=None):
+            value = cache.get(key, value)
+    return value
+
+
+def bump(scope, ident=None):
+    key = _key(scope, ident)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        value = _initial()
+        cache.set(key, value, timeout=None)
+        return value
+
+
+def bump_many(scopes):
+    # PAGES первым: кто увидел новый номер любой области, увидит и новый
+    # PAGES (на этом держится проверка в posts.views)
+    bump(PAGES)
+    for scope, ident in dict.fromkeys(scopes):
+        if scope != PAGES and (scope != GROUP or ident is not None):
+            bump(scope, ident)
+
+
+def invalidate(scopes):
+    """bump_many() сейчас и ещё раз после коммита.
+
+    Между первым увеличением и коммитом параллельный запрос может
+    прочитать старые строки уже под новыми номерами; второе увеличение
+    выбрасывает такие записи.
+    """
+    scopes = list(scopes)
+    bump_many(scopes)
+    transaction.on_commit(lambda: bump_many(scopes))
+
+
+def bump_post(post_id, author_id, *group_ids):
+    """Сбрасывает карточку поста и все ленты, в которых он виден."""
+    scopes = [(POST, post_id), (FEED, None), (AUTHOR, author_id)]
+    scopes.extend((GROUP, group_id) for group_id in group_ids)
+    invalidate(scopes)
+
+
+def one_shot():
+    """Номер, под которым запись попадает в кэш, но никогда не читается."""
+    return 'once-%s' % uuid.uuid4().hex
+
+
+def get_many(scope, idents):
+    keys = {_key(scope, ident): ident for ident in idents}
+    found = cache.get_many(list(keys))
+    missing = {key: _initial() for key in keys if key not in found}
+    for key, value in missing.items():
+        if not cache.add(key, value, timeout=None):
+            missing[key] = cache.get(key, value)
+    found.update(missing)
+    return {ident: found[key] for key, ident in keys.items()}
+
+
+def prefetch_post_versions(posts):
+    """Проставляет версии карточек всем постам страницы одним чтением."""
+    posts = list(posts)
+    versions = get_many(POST, [post.pk for post in posts])
+    for post in posts:
+        post.version = versions[post.pk]
@@ -0,0 +1,215 @@
+"""Живые обновления лент для ASGI-приложения yatube.asgi.
+
+Новый пост записывает свой id в ключи кэша тех лент, где он появился:
+общей, своей группы и ленты автора (из них собирается лента подписок).
+В процессе ASGI один опрашивающий цикл раз в LIVE_POLL_INTERVAL
+читает все ключи, за которыми следят клиенты, одним get_many() и
+раздаёт изменения очередям соединений. Ждущее соединение — это одна
+корутина, а не поток.
+
+Процессы WSGI и ASGI видят одни и те же ключи только через общий кэш
+(memcached, redis); с LocMemCache обновления не выходят за пределы
+процесса.
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.cache import cache
+from django.db import connection
+
+from . import follow_graph, reference
+
+LIVE_PATH = '/live/'
+INDEX = 'index'
+GROUP = 'group'
+AUTHOR = 'author'
+
+
+def _key(scope, ident=None):
+    if ident is None:
+        return 'live:%s' % scope
+    return 'live:%s:%s' % (scope, ident)
+
+
+def publish(post):
+    """Отмечает новый пост во всех лентах, где он появился."""
+    values = {_key(INDEX): post.pk, _key(AUTHOR, post.author_id): post.pk}
+    if post.group_id:
+        values[_key(GROUP, post.group_id)] = post.pk
+    cache.set_many(values, timeout=None)
+
+
+def _user(cookies):
+    session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    engine = import_module(settings.SESSION_ENGINE)
+    request = SimpleNamespace(session=engine.SessionStore(session_key.value))
+    user = get_user(request)
+    return user if user.is_authenticated else None
+
+
+def resolve_keys(feed, cookies):
+    """Ключи кэша для ленты из параметра ?feed=.
+
+    index — общая лента, group:<slug> — лента группы, follow — посты
+    авторов, на которых подписан владелец сессии.
+    """
+    if feed == INDEX:
+        return [_key(INDEX)]
+    if feed.startswith(GROUP + ':'):
+        group = reference.group(feed[len(GROUP) + 1:])
+        if group is None:
+            raise LookupError(feed)
+        return [_key(GROUP, group.id)]
+    if feed == 'follow':
+        user = _user(cookies)
+        if user is None:
+            raise PermissionError(feed)
+        return [_key(AUTHOR, author_id)
+                for author_id in follow_graph.following(user.pk)]
+    raise LookupError(feed)
+
+
+class Subscription:
+
+    def __init__(self, keys):
+        self.keys = frozenset(keys)
+        self.queue = asyncio.Queue()
+
+
+class Hub:
+    """Один опрос кэша на процесс для всех подключённых клиентов."""
+
+    def __init__(self):
+        self.subscriptions = set()
+        self.values = {}
+        self.task = None
+
+    def subscribe(self, keys):
+        subscription = Subscription(keys)
+        self.subscriptions.add(subscription)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while self.subscriptions:
+            keys = set().union(*(sub.keys for sub in self.subscriptions))
+            if keys:
+                values = await loop.run_in_executor(None, cache.get_many,
+                                                    list(keys))
+                self.dispatch(keys, values)
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+
+    def dispatch(self, keys, values):
+        changed = {}
+        for key in keys:
+            value = values.get(key)
+            # первое чтение ключа только запоминает значение
+            if key in self.values and value != self.values[key]:
+                changed[key] = value
+            self.values[key] = value
+        for key in set(self.values) - keys:
+            del self.values[key]
+        for subscription in list(self.subscriptions):
+            for key in subscription.keys.intersection(changed):
+                subscription.queue.put_nowait(changed[key])
+
+
+hub = Hub()
+
+
+async def _sync(func, *args):
+    """Синхронный код Django в пуле потоков, без соединения после себя."""
+    def call():
+        try:
+            return func(*args)
+        finally:
+            connection.close()
+    return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+async def _respond(send, status, body=b''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI 3: поток server-sent events на /live/?feed=..."""
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http' or scope['path'] != LIVE_PATH:
+        return await _respond(send, 404, b'Not Found')
+
+    feed = parse_qs(scope['query_string'].decode()).get('feed', [INDEX])[0]
+    cookies = SimpleCookie()
+    for name, value in scope['headers']:
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    try:
+        keys = await _sync(resolve_keys, feed, cookies)
+    except LookupError:
+        return await _respond(send, 404, b'Unknown feed')
+    except PermissionError:
+        return await _respond(send, 403, b'Login required')
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        # nginx не должен копить события в буфере
+        (b'x-accel-buffering', b'no'),
+    ]})
+    await send({'type': 'http.response.body', 'body': b': connected\n\n',
+                'more_body': True})
+
+    subscription = hub.subscribe(keys)
+    disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        while True:
+            event = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait(
+                {event, disconnect}, timeout=settings.LIVE_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                event.cancel()
+                break
+            if event in done:
+                data = json.dumps({'feed': feed, 'post_id': event.result()})
+                body = 'event: post\ndata: %s\n\n' % data
+            else:
+                event.cancel()
+                body = ': ping\n\n'
+            await send({'type': 'http.response.body',
+                        'body': body.encode(), 'more_body': True})
+    finally:
+        hub.unsubscribe(subscription)
+        disconnect.cancel()
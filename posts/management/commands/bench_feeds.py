@@ -0,0 +1,111 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+
+from posts.models import Group, Post, User
+from posts.paginator import CursorPaginator
+from posts.timeline import TimelinePaginator
+
+# индексы из миграции 0011_feed_indexes; с --compare они временно
+# удаляются внутри транзакции, которая потом откатывается
+FEED_INDEXES = (
+    'post_author_pub_date',
+    'post_group_pub_date',
+    'post_pub_date',
+    'comment_post_created',
+    'follow_author_user',
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Показывает план запроса (EXPLAIN QUERY PLAN) и время выборки '
+            'первой и глубокой страницы для каждой ленты')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--depth', type=int, default=50,
+                            help='Номер «глубокой» страницы')
+        parser.add_argument('--compare', action='store_true',
+                            help='Повторить замеры без индексов лент')
+
+    def handle(self, *args, **options):
+        feeds = self.feeds()
+        if not feeds:
+            self.stdout.write('Нет данных для замеров')
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING('С индексами'))
+        after = self.run(feeds, options, 'after')
+        if not options['compare']:
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING('Без индексов'))
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for name in FEED_INDEXES:
+                        cursor.execute('DROP INDEX IF EXISTS "%s"' % name)
+                before = self.run(feeds, options, 'before')
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(self.style.MIGRATE_HEADING('Итог, мс'))
+        for label in after:
+            self.stdout.write('%-28s %10.2f -> %8.2f' % (
+                label, before[label], after[label]))
+
+    def feeds(self):
+        feeds = {'index': lambda: CursorPaginator(Post.objects.for_feed())}
+        group = (Group.objects.annotate(total=Count('posts'))
+                 .order_by('-total').first())
+        if group is not None:
+            feeds['group_posts'] = lambda: CursorPaginator(
+                group.posts.for_feed())
+        author = (User.objects.annotate(total=Count('posts'))
+                  .order_by('-total').first())
+        if author is not None:
+            feeds['profile'] = lambda: CursorPaginator(
+                author.posts.for_feed())
+        reader = (User.objects.annotate(total=Count('follower'))
+                  .order_by('-total').first())
+        if reader is not None:
+            feeds['follow_index'] = lambda: TimelinePaginator(reader)
+        return feeds
+
+    def run(self, feeds, options, phase):
+        results = {}
+        for name, make_paginator in feeds.items():
+            paginator = make_paginator()
+            key, number = paginator._key_for_number(options['depth'])
+            cursor = paginator.encode_key(key) if key else None
+            for label, after in ((name, None),
+                                 ('%s page %s' % (name, number), cursor)):
+                with CaptureQueriesContext(connection) as queries:
+                    list(paginator.get_page(after=after))
+                elapsed = self.measure(paginator, after, options['repeat'])
+                results[label] = elapsed
+                self.stdout.write(self.style.SUCCESS(
+                    '%s: %.2f мс' % (label, elapsed)))
+                for query in queries.captured_queries:
+                    self.explain(query['sql'], phase)
+        return results
+
+    def measure(self, paginator, after, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            list(paginator.get_page(after=after))
+        return (time.perf_counter() - started) * 1000 / repeat
+
+    def explain(self, sql, phase):
+        # комментарий делает текст запроса уникальным: иначе модуль sqlite3
+        # вернёт план из своего кэша подготовленных запросов
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN %s -- %s' % (sql, phase))
+            for row in cursor.fetchall():
+                self.stdout.write('    %s' % row[-1])
+
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from posts.models import Comment, Post, User
+from posts.paginator import CursorPaginator
+
+
+class Command(BaseCommand):
+    help = ('Измеряет пропускную способность чтения ленты при одновременной '
+            'записи комментариев. Профили БД сравниваются запуском с '
+            'разными --settings')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help='Длительность замера, секунды')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Замер рассчитан на SQLite')
+        post = Post.objects.order_by('-id').first()
+        author = User.objects.order_by('id').first()
+        if post is None or author is None:
+            raise CommandError('Нет постов или пользователей для замера')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        self.stdout.write('journal_mode=%s, CONN_MAX_AGE=%s' % (
+            journal_mode, connection.settings_dict['CONN_MAX_AGE']))
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        totals = {'reads': 0, 'writes': 0, 'read_errors': 0,
+                  'write_errors': 0}
+
+        def worker(action, counter):
+            done = errors = 0
+            try:
+                while not stop.is_set():
+                    try:
+                        action()
+                        done += 1
+                    except OperationalError:
+                        # «database is locked» после истечения timeout
+                        errors += 1
+            finally:
+                connection.close()
+                with lock:
+                    totals[counter + 's'] += done
+                    totals[counter + '_errors'] += errors
+
+        def read():
+            paginator = CursorPaginator(Post.objects.for_feed())
+            list(paginator.get_page())
+
+        def write():
+            with transaction.atomic():
+                comment = Comment.objects.create(
+                    post_id=post.pk, author_id=author.pk,
+                    text='bench_sqlite_concurrency')
+                comment.delete()
+
+        threads = [threading.Thread(target=worker, args=(read, 'read'))
+                   for _ in range(options['readers'])]
+        threads += [threading.Thread(target=worker, args=(write, 'write'))
+                    for _ in range(options['writers'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            'Чтение: %.1f стр/с, ошибок %d' % (
+                totals['reads'] / elapsed, totals['read_errors'])))
+        self.stdout.write(self.style.SUCCESS(
+            'Запись: %.1f транз/с, ошибок %d' % (
+                totals['writes'] / elapsed, totals['write_errors'])))
@@ -0,0 +1,62 @@
+import json
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# выполняется в отдельном процессе: запуск с нуля, как у нового воркера
+SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.core.wsgi import get_wsgi_application
+from yatube import warmup
+application = get_wsgi_application()
+timings = {'setup': time.perf_counter() - started}
+if sys.argv[1] == 'warm':
+    timings['warmup'] = sum(warmup.warm_up(application).values())
+# warmup.call() обходит кэш целых страниц: прогрев не кладёт в него
+# копии, а первые запросы не могут оттуда их получить
+for path in sys.argv[2:]:
+    request_started = time.perf_counter()
+    warmup.call(application, path)
+    timings[path] = time.perf_counter() - request_started
+print(json.dumps(timings))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Запускает приложение в новых процессах с прогревом и без и '
+            'сравнивает время запуска и первых запросов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Адрес первого запроса, можно несколько раз')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or ['/', '/search/?q=кофе', '/auth/login/']
+        for mode in ('cold', 'warm'):
+            runs = [self.start(mode, paths) for _ in range(options['runs'])]
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                'Прогрев' if mode == 'warm' else 'Без прогрева'))
+            # медиана по запускам, в миллисекундах
+            for step in runs[0]:
+                self.stdout.write('%-24s %9.1f мс' % (
+                    step, statistics.median(run[step] for run in runs) * 1000))
+            first = statistics.median(sum(run[path] for path in paths)
+                                      for run in runs)
+            self.stdout.write(self.style.SUCCESS(
+                'Первые запросы всего: %.1f мс' % (first * 1000)))
+
+    def start(self, mode, paths):
+        # настройки (--settings) процесс наследует через окружение
+        result = subprocess.run(
+            [sys.executable, '-c', SCRIPT, mode] + paths,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        if result.returncode:
+            raise CommandError(result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
@@ -0,0 +1,166 @@
+import json
+import math
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls as posts_urls
+from posts.models import Group, Post, User
+
+PERCENTILES = (50, 95, 99)
+
+
+class Rollback(Exception):
+    pass
+
+
+def allowed_host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def percentile(values, rank):
+    """Перцентиль методом ближайшего ранга."""
+    values = sorted(values)
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Запрашивает каждую страницу из posts/urls.py тестовым клиентом '
+            'и сравнивает p50/p95/p99 и число запросов с базовым замером')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3,
+                            help='Прогоны перед замером, не учитываются')
+        parser.add_argument('--baseline',
+                            help='JSON с базовым замером для сравнения')
+        parser.add_argument('--save-baseline', metavar='PATH',
+                            help='Сохранить результаты как базовый замер')
+        parser.add_argument('--tolerance', type=float, default=20,
+                            help='Допустимое замедление p95, в процентах')
+
+    def handle(self, *args, **options):
+        # без setup_test_environment(): его инструментирование шаблонов
+        # само по себе заметно замедляет рендеринг
+        client = Client(HTTP_HOST=allowed_host())
+        requests = self.requests(client)
+        missing = ({pattern.name for pattern in posts_urls.urlpatterns}
+                   - set(requests))
+        if missing:
+            raise CommandError('Нет запроса для %s' % ', '.join(sorted(missing)))
+
+        results = {}
+        self.stdout.write('%-16s %9s %9s %9s %8s' % (
+            'url', 'p50, мс', 'p95, мс', 'p99, мс', 'запросов'))
+        for name, request in requests.items():
+            results[name] = self.measure(client, request, options)
+            self.stdout.write('%-16s %9.2f %9.2f %9.2f %8d' % (
+                name, results[name]['p50'], results[name]['p95'],
+                results[name]['p99'], results[name]['queries']))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as stream:
+                json.dump(results, stream, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as stream:
+                baseline = json.load(stream)
+            self.compare(results, baseline, options['tolerance'])
+
+    def requests(self, client):
+        # читатель с наибольшим числом подписок, самые крупные автор
+        # и группа — худший случай для лент
+        reader = (User.objects.annotate(total=Count('follower'))
+                  .order_by('-total', 'id').first())
+        group = (Group.objects.annotate(total=Count('posts'))
+                 .order_by('-total', 'id').first())
+        if reader is None or group is None:
+            raise CommandError('Сначала заполните базу: manage.py seed_yatube')
+        author = (User.objects.exclude(pk=reader.pk)
+                  .annotate(total=Count('posts'))
+                  .order_by('-total', 'id').first())
+        post = Post.objects.filter(author=reader).order_by('-id').first()
+        if post is None:
+            post = Post.objects.create(text='Пост для замеров', author=reader)
+        client.force_login(reader)
+        word = post.text.split()[0] if post.text.split() else 'пост'
+        own = [reader.username, post.id]
+        return {
+            'index': ('get', reverse('index'), {}),
+            'follow_index': ('get', reverse('follow_index'), {}),
+            'profile_follow': (
+                'get', reverse('profile_follow', args=[author.username]), {}),
+            'profile_unfollow': (
+                'get', reverse('profile_unfollow', args=[author.username]),
+                {}),
+            'groups': ('get', reverse('groups', args=[group.slug]), {}),
+            'new_post': ('post', reverse('new_post'), {'text': 'Новый пост'}),
+            'profile': ('get', reverse('profile', args=[author.username]), {}),
+            'search': ('get', reverse('search'), {'q': word}),
+            'post': ('get', reverse('post', args=own), {}),
+            'post_edit': ('post', reverse('post_edit', args=own),
+                          {'text': post.text}),
+            'post_comments': ('get', reverse('post_comments', args=own), {}),
+            'add_comment': ('post', reverse('add_comment', args=own),
+                            {'text': 'Комментарий для замеров'}),
+        }
+
+    def measure(self, client, request, options):
+        timings = []
+        queries = 0
+        for i in range(options['warmup'] + options['repeat']):
+            elapsed, count = self.call(client, request)
+            if i >= options['warmup']:
+                timings.append(elapsed)
+                queries = max(queries, count)
+        result = {'p%d' % rank: percentile(timings, rank)
+                  for rank in PERCENTILES}
+        result['queries'] = queries
+        return result
+
+    def call(self, client, request):
+        method, url, data = request
+        # каждый запрос откатывается, чтобы записи не меняли данные
+        # для следующих замеров
+        try:
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = getattr(client, method)(url, data)
+                    elapsed = (time.perf_counter() - started) * 1000
+                raise Rollback
+        except Rollback:
+            pass
+        if response.status_code >= 400:
+            raise CommandError('%s вернул %s' % (url, response.status_code))
+        return elapsed, len(captured)
+
+    def compare(self, results, baseline, tolerance):
+        self.stdout.write(self.style.MIGRATE_HEADING('Сравнение с базовым'))
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                self.stdout.write('%-16s нет в базовом замере' % name)
+                continue
+            change = (result['p95'] / before['p95'] - 1) * 100 \
+                if before['p95'] else 0
+            slower = change > tolerance
+            more_queries = result['queries'] > before['queries']
+            line = '%-16s p95 %+7.1f%%  запросов %d -> %d' % (
+                name, change, before['queries'], result['queries'])
+            if slower or more_queries:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(self.style.SUCCESS(line))
+        if regressions:
+            raise CommandError('Регрессия: %s' % ', '.join(regressions))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, пользователей, посты, комментарии и подписки '
+            'в JSONL, не загружая таблицы в память целиком')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Файл для выгрузки, «-» — stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        out = (self.stdout if path == '-'
+               else open(path, 'w', encoding='utf-8'))
+        try:
+            for line in transfer.export_rows(options['chunk_size']):
+                out.write(line + '\n')
+        finally:
+            if out is not self.stdout:
+                out.close()
@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры лент для всех постов с картинками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        post_ids = list(Post.objects.exclude(image='')
+                        .exclude(image__isnull=True)
+                        .values_list('pk', flat=True))
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = list(pool.map(thumbnails.generate_in_worker, post_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово миниатюр: {sum(results)} из {len(post_ids)}'))
@@ -0,0 +1,37 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Загружает выгрузку export_yatube пачками и один раз '
+            'пересчитывает счётчики и ленты подписок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Файл выгрузки, «-» — stdin')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        source = (sys.stdin if path == '-'
+                  else open(path, encoding='utf-8'))
+        importer = transfer.Importer(batch_size=options['batch_size'])
+        started = time.perf_counter()
+        try:
+            importer.load(source)
+        except transfer.TargetNotEmpty as error:
+            raise CommandError(error)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        loaded = time.perf_counter() - started
+        importer.finish()
+        for model, total in importer.loaded.items():
+            self.stdout.write('%s: %d' % (model, total))
+        self.stdout.write(self.style.SUCCESS(
+            'Загрузка %.1f с, пересчёт %.1f с' % (
+                loaded, time.perf_counter() - started - loaded)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import follow_graph
+from posts.models import UserCounters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики подписчиков, подписок и записей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        UserCounters.objects.rebuild(batch_size=options['batch_size'])
+        follow_graph.reset()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано счётчиков: {UserCounters.objects.count()}'))
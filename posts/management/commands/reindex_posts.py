@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--optimize', action='store_true',
+                            help='Слить сегменты индекса после перестройки')
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite')
+        search.rebuild_index(optimize=options['optimize'])
+        self.stdout.write(self.style.SUCCESS('Индекс постов перестроен'))
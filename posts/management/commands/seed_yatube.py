@@ -0,0 +1,152 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.transfer import keep_dates, rebuild_derived
+
+WORDS = ('котик', 'погода', 'город', 'книга', 'утро', 'работа', 'море',
+         'поезд', 'дождь', 'кофе', 'музыка', 'лес', 'друг', 'вечер',
+         'выходные', 'фильм', 'снег', 'лето', 'дорога', 'ужин')
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными для замеров: '
+            'пользователи, группы, посты, комментарии и подписки со '
+            'степенным распределением популярности авторов. При одном и '
+            'том же --seed данные получаются одинаковыми')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Среднее число подписок пользователя')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель степенного закона популярности')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith='seed_').exists():
+            raise CommandError('База уже заполнена seed_yatube')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # все даты отсчитываются от одного момента, чтобы одинаковый seed
+        # давал одинаковый порядок лент
+        self.now = timezone.now().replace(microsecond=0)
+        started = time.perf_counter()
+
+        user_ids = self.create_users(options['users'])
+        group_ids = self.create_groups(options['groups'])
+        # вес автора — 1 / ранг^zipf: немногие авторы получают
+        # большинство подписчиков, постов и комментариев
+        weights = [1 / rank ** options['zipf']
+                   for rank in range(1, len(user_ids) + 1)]
+        with keep_dates():
+            post_ids = self.create_posts(options['posts'], user_ids,
+                                         group_ids, weights)
+            self.create_comments(options['comments'], user_ids, post_ids)
+        self.create_follows(options['follows'], user_ids, weights)
+        loaded = time.perf_counter() - started
+
+        rebuild_derived(batch_size=self.batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            'Загрузка %.1f с, пересчёт %.1f с' % (
+                loaded, time.perf_counter() - started - loaded)))
+
+    def insert(self, model, rows):
+        """bulk_create пачками, по транзакции на пачку."""
+        total = 0
+        batch = []
+        for obj in rows:
+            batch.append(obj)
+            total += 1
+            if len(batch) >= self.batch_size:
+                self.flush(model, batch)
+                batch = []
+        self.flush(model, batch)
+        self.stdout.write('%s: %d' % (model.__name__, total))
+        return total
+
+    def flush(self, model, batch):
+        if batch:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+
+    def insert_with_ids(self, model, rows):
+        # bulk_create в SQLite не возвращает id: единственный писатель
+        # читает их после вставки по порядку
+        last = model.objects.aggregate(last=Max('id'))['last'] or 0
+        total = self.insert(model, rows)
+        ids = list(model.objects.filter(id__gt=last).order_by('id')
+                   .values_list('id', flat=True))
+        if len(ids) != total:
+            raise CommandError('Во время заполнения в %s писал кто-то ещё'
+                               % model.__name__)
+        return ids
+
+    def create_users(self, total):
+        password = make_password('password')
+        return self.insert_with_ids(User, (
+            User(username='seed_%06d' % i, password=password,
+                 date_joined=self.now - timedelta(days=365))
+            for i in range(total)))
+
+    def create_groups(self, total):
+        return self.insert_with_ids(Group, (
+            Group(title='Группа %d' % i, slug='seed-%d' % i,
+                  description='Синтетическая группа %d' % i)
+            for i in range(total)))
+
+    def text(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def create_posts(self, total, user_ids, group_ids, weights):
+        choices = self.random.choices
+        authors = choices(user_ids, weights, k=total)
+        rows = (Post(text=self.text(self.random.randint(5, 40)),
+                     author_id=authors[i],
+                     group_id=(self.random.choice(group_ids)
+                               if group_ids and self.random.random() < 0.5
+                               else None),
+                     # новые посты — с большими id, как в жизни
+                     pub_date=self.now - timedelta(seconds=(total - i) * 60))
+                for i in range(total))
+        return self.insert_with_ids(Post, rows)
+
+    def create_comments(self, total, user_ids, post_ids):
+        if not post_ids:
+            return
+        # комментируют в основном свежие посты
+        weights = [1 / (len(post_ids) - i) for i in range(len(post_ids))]
+        count = len(post_ids)
+        positions = self.random.choices(range(count), weights, k=total)
+        rows = (Comment(text=self.text(self.random.randint(2, 15)),
+                        author_id=self.random.choice(user_ids),
+                        post_id=post_ids[i],
+                        created=self.now - timedelta(
+                            seconds=(count - i) * 60
+                            - self.random.randint(1, 59)))
+                for i in positions)
+        self.insert(Comment, rows)
+
+    def create_follows(self, average, user_ids, weights):
+        def rows():
+            for user_id in user_ids:
+                # число подписок тоже неравномерно: от 0 до ~5 средних
+                wanted = min(int(self.random.expovariate(1 / average)),
+                             len(user_ids) - 1) if average else 0
+                authors = set(self.random.choices(user_ids, weights,
+                                                  k=wanted))
+                authors.discard(user_id)
+                for author_id in sorted(authors):
+                    yield Follow(user_id=user_id, author_id=author_id)
+        self.insert(Follow, rows())
@@ -0,0 +1,115 @@
+import hashlib
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+
+from . import generations
+
+# запросы с этими cookie зависят от читателя и в кэш не попадают
+STATE_COOKIES = ('SESSION_COOKIE_NAME', 'CSRF_COOKIE_NAME')
+EXTRA_STATE_COOKIES = ('messages', 'pin_primary')
+# сколько ждать перестроения страницы другим процессом, прежде чем
+# взяться за него самому
+LOCK_TIMEOUT = 10
+# ключ окружения WSGI для служебных запросов, которым не нужны ни копии
+# из кэша, ни сохранение в него (yatube.warmup)
+BYPASS_ENVIRON_KEY = 'yatube.bypass_page_cache'
+
+
+class AnonymousPageCacheMiddleware:
+    """Кэш целых страниц для гостей.
+
+    Копия страницы свежа, пока не изменились данные (поколение
+    generations.PAGES) и не истёк PAGE_CACHE_TIMEOUT. Устаревшую копию
+    перестраивает только запрос, взявший блокировку, остальные в это
+    время получают старую. Свежие копии популярных страниц иногда
+    перестраиваются заранее: чем ближе конец срока и чем дольше
+    строится страница, тем вероятнее (алгоритм XFetch).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.cookies = {getattr(settings, name) for name in STATE_COOKIES}
+        self.cookies.update(EXTRA_STATE_COOKIES)
+
+    def __call__(self, request):
+        if not self.cacheable_request(request):
+            return self.get_response(request)
+        key = self.key(request)
+        entry = cache.get(key)
+        generation = generations.get(generations.PAGES)
+        if entry is not None and self.fresh(entry, generation):
+            return self.replay(request, entry)
+        locked = cache.add(key + ':lock', 1, LOCK_TIMEOUT)
+        if not locked and entry is not None:
+            return self.replay(request, entry)
+        try:
+            started = time.monotonic()
+            response = self.get_response(request)
+            if self.cacheable_response(response):
+                self.store(key, response, generation,
+                           time.monotonic() - started)
+        finally:
+            if locked:
+                cache.delete(key + ':lock')
+        return response
+
+    def cacheable_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if request.META.get(BYPASS_ENVIRON_KEY):
+            return False
+        if self.cookies.intersection(request.COOKIES):
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        # копия из кэша отдаётся до разбора адреса обработчиком, а
+        # MetricsMiddleware учитывает запрос по resolver_match
+        request.resolver_match = match
+        return match.url_name in settings.PAGE_CACHE_URLS
+
+    def cacheable_response(self, response):
+        return (response.status_code == 200
+                and not response.streaming
+                and not response.cookies)
+
+    def key(self, request):
+        url = request.build_absolute_uri()
+        return 'page:%s' % hashlib.md5(url.encode()).hexdigest()
+
+    def fresh(self, entry, generation):
+        if entry['generation'] != generation:
+            return False
+        # delta * beta * -ln(rand): заранее перестраивается тем чаще,
+        # чем дороже страница и чем меньше осталось до конца срока
+        early = (entry['delta'] * settings.PAGE_CACHE_BETA
+                 * -math.log(1.0 - random.random()))
+        return time.time() + early < entry['expires']
+
+    def store(self, key, response, generation, delta):
+        entry = {
+            'content': response.content,
+            'status': response.status_code,
+            'headers': list(response.items()),
+            'generation': generation,
+            'delta': delta,
+            'expires': time.time() + settings.PAGE_CACHE_TIMEOUT,
+        }
+        # устаревшая копия хранится дольше, чтобы было что отдавать
+        # во время перестроения
+        cache.set(key, entry, settings.PAGE_CACHE_STALE_TIMEOUT)
+
+    def replay(self, request, entry):
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for header, value in entry['headers']:
+            response[header] = value
+        return get_conditional_response(
+            request, etag=response.get('ETag'), response=response)
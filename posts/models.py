@@ -1,5 +1,9 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+
+from . import generations
 
 User = get_user_model()
 
@@ -13,6 +17,23 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+
+    def with_comment_count(self):
+        comments = (Comment.objects
+                    .filter(post=models.OuterRef('pk'))
+                    .order_by()
+                    .values('post')
+                    .annotate(total=models.Count('pk'))
+                    .values('total'))
+        return self.annotate(
+            comment_count=Coalesce(models.Subquery(comments), 0))
+
+    def for_feed(self):
+        """Всё, что нужно карточке поста, одним запросом."""
+        return self.select_related('author', 'group').with_comment_count()
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
@@ -27,6 +48,24 @@ class Post(models.Model):
         blank=True, null=True)
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date'),
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date'),
+        ]
+
+    @cached_property
+    def version(self):
+        """Версия карточки поста, входит в ключ её кэша."""
+        return generations.get(generations.POST, self.pk)
+
 
 class Comment(models.Model):
     text = models.TextField()
@@ -38,6 +77,13 @@ class Comment(models.Model):
                              on_delete=models.CASCADE,
                              related_name="comments")
 
+    class Meta:
+        ordering = ('created', 'id')
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created'),
+        ]
+
 
 class Follow(models.Model):
     user = models.ForeignKey(User,
@@ -49,6 +95,113 @@ class Follow(models.Model):
     
     class Meta:
         constraints = [
-            models.UniqueConstraint(fields=['follower', 'following'],
+            models.UniqueConstraint(fields=['user', 'author'],
                                     name='follow unique')
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_user'),
+        ]
+
+
+class UserCountersManager(models.Manager):
+
+    def rebuild(self, batch_size=1000):
+        """Пересчитывает счётчики всех пользователей с нуля."""
+
+        def count_of(model, field):
+            subquery = (model.objects
+                        .filter(**{field: models.OuterRef('pk')})
+                        .order_by()
+                        .values(field)
+                        .annotate(total=models.Count('pk'))
+                        .values('total'))
+            return Coalesce(models.Subquery(subquery), 0)
+
+        rows = User.objects.order_by('pk').annotate(
+            followers_total=count_of(Follow, 'author'),
+            following_total=count_of(Follow, 'user'),
+            posts_total=count_of(Post, 'author'),
+        ).values_list('pk', 'followers_total', 'following_total',
+                      'posts_total')
+        with transaction.atomic():
+            self.all().delete()
+            batch = []
+            for pk, followers, following, posts in rows.iterator():
+                batch.append(self.model(user_id=pk, followers=followers,
+                                        following=following, posts=posts))
+                if len(batch) >= batch_size:
+                    self.bulk_create(batch)
+                    batch = []
+            self.bulk_create(batch)
+
+    def refresh(self, user_id):
+        counters, _ = self.update_or_create(user_id=user_id, defaults={
+            'followers': Follow.objects.filter(author_id=user_id).count(),
+            'following': Follow.objects.filter(user_id=user_id).count(),
+            'posts': Post.objects.filter(author_id=user_id).count(),
+        })
+        return counters
+
+    def bump(self, user_id, **deltas):
+        return self.filter(user_id=user_id).update(**{
+            field: models.F(field) + delta
+            for field, delta in deltas.items()
+        })
+
+    def bump_many(self, deltas):
+        """bump() для нескольких пользователей одним UPDATE.
+
+        deltas — {user_id: {поле: приращение}}.
+        """
+        fields = {field for changes in deltas.values() for field in changes}
+        return self.filter(user_id__in=list(deltas)).update(**{
+            field: models.Case(
+                *(models.When(user_id=user_id,
+                              then=models.F(field) + changes[field])
+                  for user_id, changes in deltas.items() if field in changes),
+                default=models.F(field))
+            for field in fields
+        })
+
+
+class UserCounters(models.Model):
+    """Денормализованные счётчики для карточки автора."""
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name="counters")
+    # сколько пользователей подписано на автора
+    followers = models.PositiveIntegerField(default=0)
+    # на скольких авторов подписан пользователь
+    following = models.PositiveIntegerField(default=0)
+    posts = models.PositiveIntegerField(default=0)
+
+    objects = UserCountersManager()
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписок пользователя."""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name="timeline")
+    post = models.ForeignKey(Post,
+                             on_delete=models.CASCADE,
+                             related_name="timeline_entries")
+    # копии полей поста, чтобы лента читалась одним проходом по индексу
+    author = models.ForeignKey(User,
+                               on_delete=models.CASCADE,
+                               related_name="+")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'],
+                                    name='timeline unique')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date'),
+            models.Index(fields=['user', 'author'],
+                         name='timeline_user_author'),
+        ]
@@ -0,0 +1,232 @@
+import base64
+import binascii
+
+from django.core.paginator import EmptyPage, Page, Paginator
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 20
+# старые ссылки ?page=N без курсора: дальше этой страницы номер не
+# ведёт, глубже листают по курсорам
+MAX_PAGE_NUMBER = 50
+
+
+def field_value(obj, name):
+    """Значение поля объекта модели или строки values()."""
+    if isinstance(obj, dict):
+        return obj[name]
+    return getattr(obj, name)
+
+
+class CursorPaginator:
+    """Keyset-пагинация по паре полей, например (pub_date, id).
+
+    Страницы выбираются условием «строго после/до курсора» с LIMIT,
+    поэтому не нужны ни COUNT(*), ни OFFSET. Номер страницы передаётся
+    в ссылках только для отображения; старые ссылки вида ?page=N без
+    курсора поддерживаются проходом по ключам.
+
+    Наружу отдаются обычные Page и Paginator из Django (см. make_page).
+    """
+
+    # прочие GET-параметры, которые нужно сохранить в ссылках
+    query_params = {}
+
+    def __init__(self, object_list, per_page=POSTS_PER_PAGE,
+                 ordering=('-pub_date', '-id')):
+        self.ordering = tuple(ordering)
+        self.descending = self.ordering[0].startswith('-')
+        self.fields = tuple(name.lstrip('-') for name in self.ordering)
+        self.object_list = object_list.order_by(*self.ordering)
+        self.per_page = per_page
+
+    def parse_value(self, value):
+        return parse_datetime(value)
+
+    def encode_cursor(self, obj):
+        return self.encode_key(self.key_of(obj))
+
+    @staticmethod
+    def encode_key(key):
+        value, pk = key
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        raw = '%s|%s' % (value, pk)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode()
+            value, pk = raw.rsplit('|', 1)
+            value = self.parse_value(value)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            return None
+        if value is None:
+            return None
+        return value, pk
+
+    def key_of(self, obj):
+        return tuple(field_value(obj, name) for name in self.fields)
+
+    def _seek(self, key, forward=True, queryset=None, fields=None):
+        queryset = self.object_list if queryset is None else queryset
+        first, second = fields or self.fields
+        if not forward:
+            queryset = queryset.reverse()
+        if key is None:
+            return queryset
+        value, pk = key
+        lookup = 'lt' if self.descending == forward else 'gt'
+        return queryset.filter(
+            Q(**{'%s__%s' % (first, lookup): value})
+            | Q(**{first: value, '%s__%s' % (second, lookup): pk})
+        )
+
+    def _fetch(self, key, forward, limit, keys_only=False):
+        queryset = self._seek(key, forward)
+        if keys_only:
+            return list(queryset.values_list(*self.fields)[:limit])
+        return list(queryset[:limit])
+
+    def _key_for_number(self, number):
+        """Курсор, после которого начинается страница с номером number.
+
+        Ключи всех пропускаемых страниц читаются одним запросом, а номер
+        не больше MAX_PAGE_NUMBER, поэтому ?page=N стоит не дороже
+        одного ограниченного LIMIT запроса. За концом ленты остаётся
+        последняя непустая страница; если же лента длиннее
+        MAX_PAGE_NUMBER страниц, номер за этим пределом — EmptyPage.
+        """
+        if number <= 1:
+            return None, 1
+        limit = min(number, MAX_PAGE_NUMBER + 1)
+        keys = self._fetch(None, True, self.per_page * (limit - 1) + 1,
+                           keys_only=True)
+        reached = max(min(number, (len(keys) - 1) // self.per_page + 1), 1)
+        if reached > MAX_PAGE_NUMBER:
+            raise EmptyPage('Страницы дальше %d открываются только по курсору'
+                            % MAX_PAGE_NUMBER)
+        if reached == 1:
+            return None, 1
+        return keys[self.per_page * (reached - 1) - 1], reached
+
+    def make_page(self, rows, number, has_next, has_previous):
+        """Обычная Page из Django со ссылками курсора в атрибутах.
+
+        has_next() и прочие методы Page считают страницы через COUNT(*),
+        поэтому шаблоны смотрят на атрибуты next_query, previous_query,
+        next_cursor и previous_cursor: у отсутствующей соседней страницы
+        это пустые строки.
+        """
+        page = Page(rows, number, Paginator(self.object_list, self.per_page))
+        page.next_cursor = page.previous_cursor = ''
+        page.next_query = page.previous_query = ''
+        if rows and has_next:
+            page.next_cursor = self.encode_cursor(rows[-1])
+            page.next_query = urlencode(dict(self.query_params,
+                                             after=page.next_cursor,
+                                             page=number + 1))
+        if rows and has_previous:
+            page.previous_cursor = self.encode_cursor(rows[0])
+            # на первую страницу ведём без курсора: так она всегда полная
+            if number <= 2:
+                page.previous_query = urlencode(dict(self.query_params,
+                                                     page=1))
+            else:
+                page.previous_query = urlencode(dict(
+                    self.query_params, before=page.previous_cursor,
+                    page=number - 1))
+        return page
+
+    def get_page(self, after=None, before=None, number=None):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+
+        before_key = self.decode_cursor(before)
+        if before_key is not None:
+            rows = self._fetch(before_key, False, self.per_page + 1)
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            if not has_previous:
+                number = 1
+            return self.make_page(rows, number, True, has_previous)
+
+        after_key = self.decode_cursor(after)
+        if after_key is None:
+            after_key, number = self._key_for_number(number)
+        rows = self._fetch(after_key, True, self.per_page + 1)
+        has_next = len(rows) > self.per_page
+        return self.make_page(rows[:self.per_page], number, has_next,
+                              after_key is not None)
+
+    def page(self, number):
+        return self.get_page(number=number)
+
+
+class KeyedCursorPaginator(CursorPaginator):
+    """Курсорная пагинация, где ключи страницы берутся не из object_list.
+
+    Подкласс реализует _fetch_keys(), возвращающий пары ключей
+    (значение, id) в нужном порядке, а объекты затем загружаются из
+    object_list одним запросом по списку id.
+    """
+
+    def __init__(self, object_list, per_page=POSTS_PER_PAGE,
+                 ordering=('-pub_date', '-id')):
+        super().__init__(object_list, per_page, ordering)
+        # порядок задают ключи, а не запрос к модели
+        self.object_list = object_list
+
+    def _fetch_keys(self, key, forward, limit):
+        raise NotImplementedError
+
+    def _fetch(self, key, forward, limit, keys_only=False):
+        keys = self._fetch_keys(key, forward, limit)
+        if keys_only:
+            return keys
+        # object_list может быть и запросом values(), тогда в строках
+        # обязательно поле id
+        objects = {
+            field_value(obj, 'id'): obj
+            for obj in self.object_list.filter(pk__in=[pk for _, pk in keys])
+        }
+        rows = []
+        for value, pk in keys:
+            if pk in objects:
+                obj = objects[pk]
+                if isinstance(obj, dict):
+                    obj[self.fields[0]] = value
+                else:
+                    setattr(obj, self.fields[0], value)
+                rows.append(obj)
+        return rows
+
+
+def paginate(request, paginator):
+    paginator.query_params = {
+        name: value for name, value in request.GET.items()
+        if name not in ('after', 'before', 'page')
+    }
+    try:
+        page = paginator.get_page(
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+            number=request.GET.get('page'),
+        )
+    except EmptyPage as error:
+        raise Http404(error)
+    return page, page.paginator
+
+
+def get_cursor_page(request, queryset, per_page=POSTS_PER_PAGE,
+                    ordering=('-pub_date', '-id')):
+    return paginate(request, CursorPaginator(queryset, per_page, ordering))
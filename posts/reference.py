@@ -0,0 +1,91 @@
+"""Справочные данные в памяти процесса: группы, flatpages и текущий сайт.
+
+Эти строки меняются только из админки, а читаются почти на каждой
+странице. Каждый процесс держит загруженные объекты у себя и сверяет их
+с общим номером поколения REFERENCE в кэше: сохранение или удаление
+любой такой строки увеличивает номер (posts.signals), и все процессы
+при следующем обращении выбрасывают свои копии. В установившемся режиме
+страница группы и flatpages не обращаются к базе.
+
+Промахи (несуществующие slug и адреса) тоже запоминаются, но не больше
+MAX_MISSES последних: адреса приходят от посетителей, и без предела
+случайные /group/<slug>/ съели бы память процесса.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+
+from . import generations
+from .models import Group
+
+MAX_MISSES = 1000
+
+_lock = threading.Lock()
+_entries = {}
+_misses = OrderedDict()
+_version = None
+_missing = object()
+
+
+def _get(key, load):
+    global _version
+    version = generations.get(generations.REFERENCE)
+    with _lock:
+        if version != _version:
+            _entries.clear()
+            _misses.clear()
+            _version = version
+        value = _entries.get(key, _missing)
+        if value is _missing and key in _misses:
+            _misses.move_to_end(key)
+            value = None
+    if value is _missing:
+        value = load()
+        with _lock:
+            # пока шла загрузка, данные могли измениться
+            if version == _version:
+                if value is not None:
+                    _entries[key] = value
+                else:
+                    _misses[key] = None
+                    if len(_misses) > MAX_MISSES:
+                        _misses.popitem(last=False)
+    # копия, чтобы запросы не делили кэши связанных объектов
+    return copy.copy(value)
+
+
+def group(slug):
+    """Группа по slug или None."""
+    return _get(('group', slug),
+                lambda: Group.objects.filter(slug=slug).first())
+
+
+def current_site():
+    return _get(('site', settings.SITE_ID),
+                lambda: Site.objects.get(pk=settings.SITE_ID))
+
+
+def flatpage(url, site_id):
+    """Flatpage с адресом url, доступная на сайте site_id, или None."""
+    return _get(('flatpage', site_id, url),
+                lambda: FlatPage.objects.filter(url=url,
+                                                sites=site_id).first())
+
+
+def preload():
+    """Загружает все группы и flatpages текущего сайта (для прогрева)."""
+    site = current_site()
+    for item in Group.objects.all():
+        _get(('group', item.slug), lambda: item)
+    for page in FlatPage.objects.filter(sites=site.id):
+        _get(('flatpage', site.id, page.url), lambda: page)
+
+
+def invalidate():
+    """Сбрасывает справочные данные во всех процессах."""
+    # вместе с PAGES: кэш страниц для гостей тоже показывает эти данные
+    generations.invalidate([(generations.REFERENCE, None)])
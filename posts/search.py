@@ -0,0 +1,86 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+from .paginator import (POSTS_PER_PAGE, CursorPaginator,
+                        KeyedCursorPaginator, paginate)
+
+FTS_TABLE = 'posts_post_fts'
+WORD_RE = re.compile(r'\w+')
+
+
+def fts_available():
+    return connection.vendor == 'sqlite'
+
+
+def build_match(query):
+    """Строка запроса FTS5 из пользовательского ввода.
+
+    Каждое слово берётся в кавычки, поэтому операторы FTS5 из ввода
+    не интерпретируются; слова ищутся по префиксу и все должны
+    встретиться в тексте.
+    """
+    words = WORD_RE.findall(query.lower())
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def matching_ids(match):
+    """Подзапрос с id постов, подходящих под запрос FTS5."""
+    return RawSQL(
+        'SELECT rowid FROM %s WHERE %s MATCH %%s' % (FTS_TABLE, FTS_TABLE),
+        [match])
+
+
+class SearchPaginator(KeyedCursorPaginator):
+    """Результаты поиска по релевантности (bm25) с курсором (rank, id).
+
+    Ключи читаются прямо из таблицы FTS5, которая сама сортирует по
+    встроенному столбцу rank; посты загружаются одним запросом по id.
+    """
+
+    def __init__(self, match, per_page=POSTS_PER_PAGE):
+        self.match = match
+        super().__init__(Post.objects.for_feed(), per_page,
+                         ordering=('rank', 'id'))
+
+    def parse_value(self, value):
+        return float(value)
+
+    def _fetch_keys(self, key, forward, limit):
+        sql = 'SELECT rank, rowid FROM %s WHERE %s MATCH %%s' % (
+            FTS_TABLE, FTS_TABLE)
+        params = [self.match]
+        if key is not None:
+            lookup = '>' if forward else '<'
+            sql += ' AND (rank {0} %s OR (rank = %s AND rowid {0} %s))'.format(
+                lookup)
+            params.extend([key[0], key[0], key[1]])
+        direction = 'ASC' if forward else 'DESC'
+        sql += ' ORDER BY rank {0}, rowid {0} LIMIT %s'.format(direction)
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [tuple(row) for row in cursor.fetchall()]
+
+
+def search_page(request, query, per_page=POSTS_PER_PAGE):
+    match = build_match(query)
+    if not match:
+        return None, None
+    if fts_available():
+        return paginate(request, SearchPaginator(match, per_page))
+    # без FTS5 остаётся обычный поиск подстроки по свежим постам
+    queryset = Post.objects.for_feed().filter(text__icontains=query)
+    return paginate(request, CursorPaginator(queryset, per_page))
+
+
+def rebuild_index(optimize=False):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO %s(%s) VALUES ('rebuild')" % (FTS_TABLE, FTS_TABLE))
+        if optimize:
+            cursor.execute(
+                "INSERT INTO %s(%s) VALUES ('optimize')" % (FTS_TABLE,
+                                                           FTS_TABLE))
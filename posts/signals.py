@@ -0,0 +1,188 @@
+from django.db import transaction
+from django.contrib.flatpages.models import FlatPage
+from django.contrib.sites.models import Site
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import (follow_graph, generations, live, reference, timeline,
+               usernames)
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+
+def _bump_or_refresh(user_id, **deltas):
+    # строки может не быть у пользователей, созданных до счётчиков
+    if not UserCounters.objects.bump(user_id, **deltas):
+        UserCounters.objects.refresh(user_id)
+
+
+@receiver(post_save, sender=User)
+def create_user_counters(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserCounters.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _bump_or_refresh(instance.author_id, posts=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    # при удалении пользователя его строка счётчиков удаляется каскадом,
+    # поэтому здесь только уменьшаем существующие значения
+    UserCounters.objects.bump(instance.author_id, posts=-1)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _bump_or_refresh(instance.author_id, followers=1)
+        _bump_or_refresh(instance.user_id, following=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    # словарь собирается по шагам: подписка на себя возможна из админки
+    deltas = {instance.author_id: {'followers': -1}}
+    deltas.setdefault(instance.user_id, {})['following'] = -1
+    UserCounters.objects.bump_many(deltas)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clear_timeline(sender, instance, **kwargs):
+    timeline.remove(instance.user_id, instance.author_id)
+    # счётчик подписчиков уже уменьшен в count_deleted_follow
+    timeline.catch_up(instance.author_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_group(sender, instance, raw=False, **kwargs):
+    # при смене группы пост пропадает и из ленты старой группы
+    instance._previous_group_id = None
+    if not raw and instance.pk and not instance._state.adding:
+        instance._previous_group_id = (Post.objects
+                                       .filter(pk=instance.pk)
+                                       .values_list('group_id', flat=True)
+                                       .first())
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post_generations(sender, instance, **kwargs):
+    generations.bump_post(instance.pk, instance.author_id, instance.group_id,
+                          getattr(instance, '_previous_group_id', None))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_comment_generations(sender, instance, **kwargs):
+    post = (Post.objects.filter(pk=instance.post_id)
+            .values_list('author_id', 'group_id').first())
+    if post is not None:
+        generations.bump_post(instance.post_id, *post)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_follow_generations(sender, instance, **kwargs):
+    # карточка автора показывает счётчики подписок, а профиль — кнопку
+    # подписки, поэтому их страницы тоже должны обновиться
+    generations.invalidate([(generations.AUTHOR, instance.author_id),
+                            (generations.AUTHOR, instance.user_id)])
+
+
+@receiver(post_save, sender=Group)
+def bump_group_generation(sender, instance, created, raw=False, **kwargs):
+    scopes = [(generations.GROUP, instance.pk)]
+    if not created and not raw:
+        # название и slug группы выводятся в карточках её постов, а те —
+        # в общей ленте и в профилях авторов
+        scopes.append((generations.FEED, None))
+        scopes.extend(
+            (generations.AUTHOR, author_id)
+            for author_id in Post.objects.filter(group=instance)
+            .values_list('author_id', flat=True).distinct())
+    generations.invalidate(scopes)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def update_follow_graph(sender, instance, **kwargs):
+    follow_graph.forget(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def publish_new_post(sender, instance, created, raw=False, **kwargs):
+    # клиенты сразу запросят ленту, поэтому только после коммита
+    if created and not raw:
+        transaction.on_commit(lambda: live.publish(instance))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=FlatPage)
+@receiver(post_delete, sender=FlatPage)
+@receiver(m2m_changed, sender=FlatPage.sites.through)
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_reference(sender, **kwargs):
+    reference.invalidate()
+
+
+def _bump_renamed_user(user_id):
+    # имя входит в адреса постов и профиля: карточки постов автора,
+    # ленты с ними, страницы постов с его комментариями и ETag этих
+    # страниц иначе продолжат ссылаться на старое имя, то есть на 404
+    posts = Post.objects.filter(author_id=user_id)
+    scopes = [(generations.AUTHOR, user_id), (generations.FEED, None)]
+    scopes.extend((generations.GROUP, group_id) for group_id in
+                  posts.values_list('group_id', flat=True).distinct())
+    post_ids = set(posts.values_list('pk', flat=True))
+    post_ids.update(Comment.objects.filter(author_id=user_id)
+                    .values_list('post_id', flat=True))
+    scopes.extend((generations.POST, pk) for pk in post_ids)
+    generations.invalidate(scopes)
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, raw=False, update_fields=None,
+                      **kwargs):
+    # вход обновляет только last_login, имя при этом не меняется
+    instance._previous_username = None
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    if not raw and instance.pk and not instance._state.adding:
+        instance._previous_username = (User.objects
+                                       .filter(pk=instance.pk)
+                                       .values_list('username', flat=True)
+                                       .first())
+
+
+@receiver(post_save, sender=User)
+def forget_new_username(sender, instance, created, **kwargs):
+    # у нового имени мог быть закэширован промах
+    previous = getattr(instance, '_previous_username', None)
+    renamed = previous is not None and previous != instance.username
+    if created or renamed:
+        usernames.forget(instance.username, previous)
+    if renamed:
+        _bump_renamed_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_username(sender, instance, **kwargs):
+    usernames.forget(instance.username)
@@ -0,0 +1,23 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def feed_image_url(post):
+    """Адрес готовой миниатюры, а пока её нет — исходной картинки.
+
+    В лентах адрес заранее проставлен для всей страницы
+    thumbnails.prefetch_feed_images(), здесь остаётся только его вывести.
+    """
+    if not post.image:
+        return ''
+    if hasattr(post, 'image_url'):
+        return post.image_url
+    thumbnail = thumbnails.ready_feed_thumbnail(post.image)
+    if thumbnail is not None:
+        return thumbnail.url
+    thumbnails.schedule(post)
+    return post.image.url
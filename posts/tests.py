@@ -1,17 +1,39 @@
-from django.test import TestCase, Client, override_settings
-from .models import Post, Group, User, Follow, Comment
+from django.test import (TestCase, TransactionTestCase, Client,
+                         RequestFactory, override_settings)
+from django.http import HttpResponse
+from yatube import metrics
+from yatube.db_routers import (LAST_WRITE_KEY, PIN_COOKIE, ReplicaMiddleware,
+                               ReplicaRouter)
+from .middleware import AnonymousPageCacheMiddleware
+from . import (follow_graph, generations, live, reference, thumbnails,
+               paginator, timeline, usernames, views, urls as posts_urls)
+from .models import (Post, Group, User, Follow, Comment, TimelineEntry,
+                     UserCounters)
 from django.shortcuts import reverse
+from django.conf import settings
+from django.contrib.flatpages.models import FlatPage
 from django.core.cache import caches, cache
 from django.core.cache.utils import make_template_fragment_key
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.files.base import File
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
 from PIL import Image
-from io import BytesIO
+import asyncio
+import json
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+from types import SimpleNamespace
+from io import BytesIO, StringIO
+from django.core.management import call_command, CommandError
 
 
 class TestBasicFunctions(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(
             username="username1", password='test'
@@ -50,10 +72,33 @@ class TestBasicFunctions(TestCase):
 
     def test_cache(self):
         cache = caches['default']
-        key = make_template_fragment_key('index_page')
-        self.client.get(reverse('index'))
+        response = self.client.get(reverse('index'))
+        key = make_template_fragment_key(
+            'index_page',
+            [response.context['generation'], self.user.pk, '', '', ''])
         self.assertTrue(cache.get(key))
 
+    def test_cache_invalidated_by_new_post(self):
+        urls = [
+            reverse('index'),
+            reverse('groups', args=[self.group.slug]),
+            reverse('profile', args=[self.user.username]),
+        ]
+        for url in urls:
+            self.client.get(url)
+        post = Post.objects.create(text='свежий пост', author=self.user,
+                                   group=self.group)
+        for url in urls:
+            self.assertContains(self.client.get(url), 'свежий пост')
+        Comment.objects.create(text='комментарий', author=self.user1,
+                               post=post)
+        for url in urls:
+            self.assertContains(self.client.get(url), 'Комментариев: 1')
+        post.group = self.group1
+        post.save()
+        response = self.client.get(reverse('groups', args=[self.group.slug]))
+        self.assertNotContains(response, 'свежий пост')
+
     
     def test_404_err(self):
         text = 'testtesttest'
@@ -226,3 +271,1369 @@ class TestBasicFunctions(TestCase):
                          {'text': text,
                           'post' : post.id})
         self.assertEqual(Comment.objects.count(), 0)
+
+
+class TestCursorPagination(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="pager", password='test')
+        self.group = Group.objects.create(title='pager', slug='pager')
+        Post.objects.bulk_create([
+            Post(text=f'post {i}', author=self.user, group=self.group)
+            for i in range(25)
+        ])
+        self.urls = [
+            reverse('index'),
+            reverse('groups', args=[self.group.slug]),
+            reverse('profile', args=[self.user.username]),
+        ]
+
+    def test_walk_pages_by_cursor(self):
+        for url in self.urls:
+            seen = []
+            query = ''
+            while True:
+                response = self.client.get(f'{url}?{query}')
+                page = response.context['page']
+                seen.extend(post.id for post in page)
+                if not page.next_query:
+                    break
+                query = page.next_query
+            self.assertEqual(len(seen), 25)
+            self.assertEqual(len(set(seen)), 25)
+            self.assertEqual(page.number, 3)
+
+    def test_previous_page(self):
+        first = self.client.get(self.urls[0]).context['page']
+        second = self.client.get(
+            f'{self.urls[0]}?{first.next_query}').context['page']
+        third = self.client.get(
+            f'{self.urls[0]}?{second.next_query}').context['page']
+        back = self.client.get(
+            f'{self.urls[0]}?{third.previous_query}').context['page']
+        self.assertEqual([p.id for p in back], [p.id for p in second])
+        self.assertEqual(back.number, 2)
+        self.assertEqual(second.previous_query, 'page=1')
+
+    def test_legacy_page_number(self):
+        response = self.client.get(f"{reverse('index')}?page=3")
+        page = response.context['page']
+        self.assertEqual(page.number, 3)
+        self.assertEqual(len(page), 5)
+        self.assertFalse(page.next_query)
+        response = self.client.get(f"{reverse('index')}?page=100")
+        self.assertEqual(response.context['page'].number, 3)
+
+    def test_page_number_costs_one_query(self):
+        Post.objects.bulk_create([
+            Post(text=f'old {i}', author=self.user) for i in range(600)
+        ])
+        for number in (2, paginator.MAX_PAGE_NUMBER):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(
+                    f"{reverse('index')}?page={number}")
+            posts = [q for q in queries.captured_queries
+                     if 'FROM "posts_post"' in q['sql']]
+            self.assertEqual(len(posts), 2)
+        page = response.context['page']
+        self.assertEqual(page.number, paginator.MAX_PAGE_NUMBER)
+        self.assertTrue(page.next_query)
+
+        # глубже MAX_PAGE_NUMBER только по курсору, а не страница 50
+        # под чужим номером
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{reverse('index')}?page=99999")
+        self.assertEqual(response.status_code, 404)
+        posts = [q for q in queries.captured_queries
+                 if 'FROM "posts_post"' in q['sql']]
+        self.assertEqual(len(posts), 1)
+        response = self.client.get(
+            f"{reverse('api_index')}?page={paginator.MAX_PAGE_NUMBER + 1}")
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+    def test_page_number_past_short_feed_shows_last_page(self):
+        response = self.client.get(f"{reverse('index')}?page=99999")
+        page = response.context['page']
+        self.assertEqual(page.number, 3)
+        self.assertFalse(page.next_query)
+
+    def test_no_count_no_offset(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f"{reverse('index')}?page=2")
+        sql = ' '.join(q['sql'].upper() for q in queries.captured_queries)
+        self.assertNotIn('COUNT(*)', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        response = self.client.get(f"{reverse('index')}?after=garbage")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page'].number, 1)
+        self.assertEqual(len(response.context['page']), 10)
+
+
+class TestUserCounters(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="author", password='test')
+        self.reader = User.objects.create_user(username="reader", password='test')
+        self.client.force_login(self.reader)
+
+    def assertCounters(self, user, followers, following, posts):
+        counters = UserCounters.objects.get(user=user)
+        self.assertEqual(
+            (counters.followers, counters.following, counters.posts),
+            (followers, following, posts))
+
+    def test_counters_follow_posts(self):
+        post = Post.objects.create(text='text', author=self.author)
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        self.assertCounters(self.author, 1, 0, 1)
+        self.assertCounters(self.reader, 0, 1, 0)
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        post.delete()
+        self.assertCounters(self.author, 0, 0, 0)
+        self.assertCounters(self.reader, 0, 0, 0)
+
+    def test_missing_row_is_refreshed(self):
+        Post.objects.create(text='text', author=self.author)
+        UserCounters.objects.all().delete()
+        Post.objects.create(text='text', author=self.author)
+        self.assertCounters(self.author, 0, 0, 2)
+
+    def test_rebuild_command(self):
+        Post.objects.create(text='text', author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserCounters.objects.update(followers=42, following=42, posts=42)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertCounters(self.author, 1, 0, 1)
+        self.assertCounters(self.reader, 0, 1, 0)
+
+    def test_profile_card(self):
+        Post.objects.create(text='text', author=self.author)
+        response = self.client.get(reverse('profile', args=[self.author]))
+        self.assertContains(response, 'Записей: 1')
+
+
+class TestTimeline(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.reader = User.objects.create_user(username="reader", password='test')
+        self.author = User.objects.create_user(username="author", password='test')
+        self.star = User.objects.create_user(username="star", password='test')
+        self.client.force_login(self.reader)
+
+    def feed_ids(self, query=''):
+        response = self.client.get(f"{reverse('follow_index')}?{query}")
+        return [post.id for post in response.context['page']]
+
+    def test_fan_out_backfill_and_remove(self):
+        old = Post.objects.create(text='old', author=self.author)
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=old).exists())
+        self.client.post(reverse('new_post'), {'text': 'mine'})
+        new = Post.objects.create(text='new', author=self.author)
+        self.assertEqual(self.feed_ids(), [new.id, old.id])
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(self.feed_ids(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_author_merged_on_read(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.star)
+        posts = []
+        for i in range(15):
+            posts.append(Post.objects.create(
+                text=f'post {i}', author=self.star if i % 2 else self.author))
+        # после подписки раскладывать по лентам больше нечего
+        self.assertFalse(TimelineEntry.objects.filter(
+            post__in=posts).exists())
+        expected = [post.id for post in reversed(posts)]
+        response = self.client.get(reverse('follow_index'))
+        page = response.context['page']
+        second = self.feed_ids(page.next_query)
+        self.assertEqual([p.id for p in page] + second, expected)
+
+    @override_settings(TIMELINE_BACKFILL_SIZE=2)
+    def test_rebuild_keeps_latest_posts_per_follow(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.author, author=self.star)
+        posts = [Post.objects.create(text=f'post {i}',
+                                     author=self.star if i % 2 else self.author)
+                 for i in range(6)]
+        TimelineEntry.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            timeline.rebuild()
+        self.assertLessEqual(len(queries.captured_queries), 4)
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list('user_id', 'post_id')),
+            {(self.reader.id, posts[4].id), (self.reader.id, posts[2].id),
+             (self.reader.id, posts[5].id), (self.reader.id, posts[3].id),
+             (self.author.id, posts[5].id), (self.author.id, posts[3].id)})
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_catch_up_below_limit(self):
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.author, author=self.star)
+        post = Post.objects.create(text='popular', author=self.star)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        Follow.objects.get(user=self.author, author=self.star).delete()
+        # автор снова раскладывается, пост не должен пропасть из ленты
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, post=post).exists())
+        self.assertEqual(self.feed_ids(), [post.id])
+
+    def test_mixed_sources_without_duplicates(self):
+        Follow.objects.create(user=self.reader, author=self.star)
+        posts = [Post.objects.create(text=f'post {i}', author=self.star)
+                 for i in range(3)]
+        with self.settings(TIMELINE_FANOUT_LIMIT=0):
+            self.assertEqual(self.feed_ids(),
+                             [post.id for post in reversed(posts)])
+
+
+class TestPostCardCache(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password='test')
+        self.reader = User.objects.create_user(username="reader", password='test')
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.post = Post.objects.create(text='первый', author=self.author)
+        self.other = Post.objects.create(text='второй', author=self.author)
+
+    def card_key(self, post):
+        post = Post.objects.get(pk=post.pk)
+        return make_template_fragment_key('post_card', [
+            post.id, post.version, post.author.username,
+            post.group.slug if post.group else '',
+            post.group.title if post.group else ''])
+
+    def test_card_shared_between_feeds(self):
+        self.reader_client.get(reverse('index'))
+        key = self.card_key(self.post)
+        self.assertIn('первый', cache.get(key))
+        cache.set(key, cache.get(key).replace('первый', 'из кэша'))
+        response = self.reader_client.get(
+            reverse('profile', args=[self.author.username]))
+        self.assertContains(response, 'из кэша')
+
+    def test_edit_and_comment_invalidate_one_card(self):
+        self.reader_client.get(reverse('index'))
+        post_key = self.card_key(self.post)
+        other_key = self.card_key(self.other)
+        self.reader_client.post(
+            reverse('add_comment', args=[self.author.username, self.post.id]),
+            {'text': 'комментарий'})
+        self.assertNotEqual(self.card_key(self.post), post_key)
+        self.assertEqual(self.card_key(self.other), other_key)
+        self.author_client.post(
+            reverse('post_edit', args=[self.author.username, self.other.id]),
+            {'text': 'исправлен'})
+        self.assertNotEqual(self.card_key(self.other), other_key)
+        self.assertContains(self.reader_client.get(reverse('index')),
+                            'исправлен')
+
+    def test_group_rename_reaches_cached_cards(self):
+        group = Group.objects.create(title='старое', slug='old')
+        self.post.group = group
+        self.post.save()
+        urls = [reverse('index'),
+                reverse('profile', args=[self.author.username])]
+        for url in urls:
+            self.assertContains(self.reader_client.get(url), '#старое')
+        group.title = 'новое'
+        group.slug = 'new'
+        group.save()
+        for url in urls:
+            response = self.reader_client.get(url)
+            self.assertContains(response, '#новое')
+            self.assertContains(response, reverse('groups', args=['new']))
+
+    def test_edit_button_depends_on_viewer(self):
+        url = reverse('profile', args=[self.author.username])
+        edit_url = reverse('post_edit', args=[self.author.username, self.post.id])
+        self.assertNotContains(self.reader_client.get(url), edit_url)
+        self.assertContains(self.author_client.get(url), edit_url)
+        self.assertNotContains(self.reader_client.get(url), edit_url)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestBackgroundThumbnails(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="author", password='test')
+        self.client.force_login(self.user)
+
+    def create_post(self):
+        image = TestBasicFunctions.get_image_file(name='thumb.png')
+        self.client.post(reverse('new_post'),
+                         {'text': 'с картинкой', 'image': image})
+        return Post.objects.latest('pk')
+
+    def test_original_until_thumbnail_ready(self):
+        post = self.create_post()
+        self.assertIsNone(thumbnails.ready_feed_thumbnail(post.image))
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, post.image.url)
+        self.assertTrue(thumbnails.generate(post.id))
+        thumbnail = thumbnails.ready_feed_thumbnail(post.image)
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, thumbnail.url)
+
+    def test_page_thumbnails_resolved_in_one_batch(self):
+        posts = [self.create_post() for _ in range(3)]
+        for post in posts[:2]:
+            thumbnails.generate(post.id)
+        ready = [thumbnails.ready_feed_thumbnail(post.image).url
+                 for post in posts[:2]]
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        kvstore_queries = [q for q in queries.captured_queries
+                           if 'thumbnail_kvstore' in q['sql']]
+        self.assertEqual(len(kvstore_queries), 1)
+        for url in ready:
+            self.assertContains(response, url)
+        self.assertContains(response, posts[2].image.url)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class TestGenerateThumbnailsCommand(TransactionTestCase):
+
+    def test_generate_command(self):
+        user = User.objects.create_user(username="author", password='test')
+        post = Post.objects.create(
+            text='с картинкой', author=user,
+            image=SimpleUploadedFile(
+                'thumb.png',
+                TestBasicFunctions.get_image_file().read()))
+        out = StringIO()
+        call_command('generate_thumbnails', workers=1, stdout=out)
+        self.assertIn('1 из 1', out.getvalue())
+        self.assertIsNotNone(thumbnails.ready_feed_thumbnail(post.image))
+
+
+class TestSearch(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="writer", password='test')
+
+    def search(self, query, extra=''):
+        response = self.client.get(f"{reverse('search')}?q={query}{extra}")
+        self.assertEqual(response.status_code, 200)
+        return response.context['page']
+
+    def test_ranked_results(self):
+        weak = Post.objects.create(
+            text='Длинный рассказ про город, реку, лес и одна кошка',
+            author=self.user)
+        strong = Post.objects.create(text='Кошка, кошка и ещё кошка',
+                                     author=self.user)
+        Post.objects.create(text='Про собак', author=self.user)
+        self.assertEqual([post.id for post in self.search('кошка')],
+                         [strong.id, weak.id])
+
+    def test_index_follows_post_changes(self):
+        post = Post.objects.create(text='старый текст', author=self.user)
+        self.assertEqual(len(self.search('старый')), 1)
+        post.text = 'новый текст'
+        post.save()
+        self.assertEqual(len(self.search('старый')), 0)
+        self.assertEqual(len(self.search('новый')), 1)
+        post.delete()
+        self.assertEqual(len(self.search('новый')), 0)
+
+    def test_cursor_keeps_query(self):
+        for i in range(15):
+            Post.objects.create(text=f'поиск номер {i}', author=self.user)
+        Post.objects.create(text='посторонний', author=self.user)
+        first = self.search('поиск')
+        self.assertIn('q=', first.next_query)
+        second = self.search('поиск', '&' + first.next_query)
+        ids = [post.id for post in first] + [post.id for post in second]
+        self.assertEqual(len(set(ids)), 15)
+        self.assertFalse(second.next_query)
+
+    def test_operators_in_input_are_plain_words(self):
+        Post.objects.create(text='NEAR OR AND', author=self.user)
+        self.assertEqual(len(self.search('"NEAR OR*')), 1)
+        self.assertIsNone(
+            self.client.get(f"{reverse('search')}?q=***").context['page'])
+
+    def test_admin_search_and_reindex(self):
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'test')
+        post = Post.objects.create(text='админский поиск', author=self.user)
+        Post.objects.create(text='что-то другое', author=self.user)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO posts_post_fts(posts_post_fts) "
+                           "VALUES ('delete-all')")
+        self.assertEqual(len(self.search('админский')), 0)
+        call_command('reindex_posts', stdout=StringIO())
+        self.client.force_login(admin)
+        response = self.client.get('/admin/posts/post/?q=админский')
+        self.assertEqual(
+            list(response.context['cl'].result_list), [post])
+
+
+class TestBenchFeedsCommand(TestCase):
+
+    def test_compare_prints_plans_and_timings(self):
+        user = User.objects.create_user(username="bench", password='test')
+        group = Group.objects.create(title='bench', slug='bench')
+        Post.objects.bulk_create([
+            Post(text=f'post {i}', author=user, group=group)
+            for i in range(30)
+        ])
+        out = StringIO()
+        call_command('bench_feeds', compare=True, repeat=1, depth=2,
+                     stdout=out)
+        output = out.getvalue()
+        self.assertIn('USING INDEX post_pub_date', output)
+        self.assertIn('index page 2', output)
+        self.assertIn('Итог', output)
+        self.assertTrue(connection.introspection.get_constraints(
+            connection.cursor(), 'posts_post').get('post_pub_date'))
+
+
+class TestSeedAndBenchUrls(TestCase):
+    seed_options = {'users': 8, 'groups': 2, 'posts': 40, 'comments': 60,
+                    'follows': 3, 'batch_size': 7}
+
+    def snapshot(self):
+        return (
+            list(Post.objects.order_by('id')
+                 .values_list('author__username', 'group__slug', 'text')),
+            list(Comment.objects.order_by('id')
+                 .values_list('author__username', 'post__text', 'text')),
+            sorted(Follow.objects.values_list('user__username',
+                                              'author__username')),
+        )
+
+    def test_seed_is_repeatable(self):
+        call_command('seed_yatube', stdout=StringIO(), **self.seed_options)
+        self.assertEqual(User.objects.count(), 8)
+        self.assertEqual(Post.objects.count(), 40)
+        self.assertEqual(Comment.objects.count(), 60)
+        first = self.snapshot()
+        with self.assertRaises(CommandError):
+            call_command('seed_yatube', stdout=StringIO(), **self.seed_options)
+
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        call_command('seed_yatube', stdout=StringIO(), **self.seed_options)
+        self.assertEqual(self.snapshot(), first)
+        author = User.objects.get(username=first[0][0][0])
+        self.assertEqual(author.counters.posts, author.posts.count())
+
+    def test_bench_urls_compares_with_baseline(self):
+        call_command('seed_yatube', stdout=StringIO(), **self.seed_options)
+        posts = Post.objects.count()
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as baseline:
+            out = StringIO()
+            call_command('bench_urls', repeat=3, warmup=0,
+                         save_baseline=baseline.name, stdout=out)
+            results = json.load(baseline)
+            self.assertEqual(set(results), {pattern.name for pattern
+                                            in posts_urls.urlpatterns})
+            self.assertLessEqual(results['index']['p50'],
+                                 results['index']['p99'])
+            self.assertIn('add_comment', out.getvalue())
+            # записи откатываются после каждого замера
+            self.assertEqual(Post.objects.count(), posts)
+
+            results['index']['queries'] = 0
+            with open(baseline.name, 'w') as stream:
+                json.dump(results, stream)
+            with self.assertRaisesMessage(CommandError, 'index'):
+                call_command('bench_urls', repeat=1, warmup=0,
+                             baseline=baseline.name, tolerance=10 ** 6,
+                             stdout=StringIO())
+
+
+class TestProductionSQLite(TestCase):
+
+    def test_pragmas_applied_on_connect(self):
+        from yatube.db_backends.sqlite3.base import DatabaseWrapper
+        from yatube import settings_production
+
+        with tempfile.TemporaryDirectory() as directory:
+            settings_dict = dict(settings_production.DATABASES['default'],
+                                 NAME=directory + '/prod.sqlite3')
+            wrapper = DatabaseWrapper(settings_dict)
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 5000)
+                # транзакция сразу берёт блокировку на запись
+                wrapper.set_autocommit(
+                    False, force_begin_transaction_with_broken_autocommit=True)
+                other = sqlite3.connect(settings_dict['NAME'], timeout=0)
+                with self.assertRaises(sqlite3.OperationalError):
+                    other.execute('BEGIN IMMEDIATE')
+                other.close()
+                wrapper.rollback()
+            finally:
+                wrapper.close()
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=5)
+class TestReplicaRouter(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        # последний коммит давно: реплика успела его получить
+        cache.set(LAST_WRITE_KEY, time.time() - 60)
+
+    def serve(self, request, write=False):
+        seen = {}
+
+        def view(request):
+            seen['before'] = self.router.db_for_read(Post)
+            if write:
+                self.router.db_for_write(Post)
+                seen['after'] = self.router.db_for_read(Post)
+            return HttpResponse()
+
+        response = ReplicaMiddleware(view)(request)
+        return seen, response
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_safe_request_reads_from_replica(self):
+        seen, response = self.serve(self.factory.get('/'))
+        self.assertEqual(seen['before'], 'replica')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_recent_commit_keeps_reads_on_primary(self):
+        cache.set(LAST_WRITE_KEY, time.time())
+        seen, _ = self.serve(self.factory.get('/'))
+        self.assertEqual(seen['before'], 'default')
+
+        cache.delete(LAST_WRITE_KEY)
+        seen, _ = self.serve(self.factory.get('/'))
+        self.assertEqual(seen['before'], 'default')
+
+    def test_write_pins_reads_to_primary(self):
+        seen, response = self.serve(self.factory.post('/'), write=True)
+        self.assertEqual(seen['before'], 'default')
+        self.assertEqual(seen['after'], 'default')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+        request = self.factory.get('/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        seen, _ = self.serve(request)
+        self.assertEqual(seen['before'], 'default')
+
+    def test_write_inside_safe_request(self):
+        seen, response = self.serve(self.factory.get('/'), write=True)
+        self.assertEqual(seen['before'], 'replica')
+        self.assertEqual(seen['after'], 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'posts'))
+        self.assertIsNone(self.router.allow_migrate('default', 'posts'))
+
+
+@override_settings(DATABASE_REPLICAS=['stale'], REPLICA_PIN_SECONDS=5)
+class TestStaleReplica(TransactionTestCase):
+    """Реплика — снимок основной базы, новые записи в неё не попадают."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer",
+                                               password='test')
+        Post.objects.create(text='старый пост', author=self.author)
+        connections.databases['stale'] = {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+        self.addCleanup(connections.databases.pop, 'stale')
+        self.addCleanup(connections.__delitem__, 'stale')
+        replica = connections['stale']
+        self.addCleanup(replica.close)
+        replica.ensure_connection()
+        connection.ensure_connection()
+        connection.connection.backup(replica.connection)
+
+    def test_pages_after_commit_are_cached_from_primary(self):
+        Post.objects.create(text='новый пост', author=self.author)
+        self.assertFalse(
+            Post.objects.using('stale').filter(text='новый пост').exists())
+
+        for name, kwargs in (('index', {}), ('profile', {'username': 'writer'})):
+            response = self.client.get(reverse(name, kwargs=kwargs))
+            self.assertContains(response, 'новый пост')
+
+        # реплика считается догнавшей основную базу, а кэш собран из
+        # основной базы
+        cache.set(LAST_WRITE_KEY, time.time() - 60)
+        for name, kwargs in (('index', {}), ('profile', {'username': 'writer'})):
+            response = self.client.get(reverse(name, kwargs=kwargs))
+            self.assertContains(response, 'новый пост')
+
+    def test_fresh_replica_serves_reads(self):
+        cache.set(LAST_WRITE_KEY, time.time() - 60)
+        Post.objects.using('default').filter(text='старый пост').update(
+            text='правка мимо реплики')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'старый пост')
+
+
+class TestExportImport(TestCase):
+
+    def test_round_trip(self):
+        author = User.objects.create_user(username="writer", password='test')
+        reader = User.objects.create_user(username="reader", password='test')
+        group = Group.objects.create(title='g', slug='g', description='d')
+        post = Post.objects.create(text='текст', author=author, group=group)
+        Comment.objects.create(text='ответ', author=reader, post=post)
+        Follow.objects.create(user=reader, author=author)
+        pub_date = Post.objects.get().pub_date
+
+        out = StringIO()
+        call_command('export_yatube', stdout=out)
+        dump = out.getvalue()
+        self.assertEqual(len(dump.splitlines()), 6)
+
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as source:
+            source.write(dump)
+            source.flush()
+            call_command('import_yatube', source.name, batch_size=1,
+                         stdout=StringIO())
+            # id сохраняются, поэтому в непустую базу импорт не пускает
+            with self.assertRaises(CommandError):
+                call_command('import_yatube', source.name, stdout=StringIO())
+
+        self.assertEqual(Follow.objects.count(), 1)
+        imported = Post.objects.get()
+        self.assertEqual(
+            (imported.id, imported.text, imported.pub_date, imported.group.slug),
+            (post.id, 'текст', pub_date, 'g'))
+        post = imported
+        self.assertEqual(post.comments.get().author.username, 'reader')
+        reader = User.objects.get(username='reader')
+        self.assertTrue(reader.check_password('test'))
+        self.assertEqual(post.author.counters.followers, 1)
+        self.assertEqual(reader.counters.following, 1)
+        self.assertEqual(post.author.counters.posts, 1)
+        self.assertTrue(TimelineEntry.objects.filter(user=reader,
+                                                     post=post).exists())
+
+
+class TestConditionalGet(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="reader",
+                                             password='test')
+        self.author = User.objects.create_user(username="writer",
+                                               password='test')
+        self.group = Group.objects.create(title='g', slug='g')
+        self.post = Post.objects.create(text='text', author=self.author,
+                                        group=self.group)
+        self.client.force_login(self.user)
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        return etag, response, queries
+
+    def test_unchanged_pages_answer_304(self):
+        urls = [
+            reverse('index'),
+            reverse('groups', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('post', args=[self.author.username, self.post.id]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                _, response, queries = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                # ни ленты, ни списка комментариев
+                self.assertLessEqual(len(queries.captured_queries), 3)
+                self.assertFalse(any(
+                    query['sql'].startswith('SELECT "posts_comment"')
+                    for query in queries.captured_queries))
+
+    def test_index_skips_feed_query(self):
+        _, response, queries = self.revalidate(reverse('index'))
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('FROM "posts_post"' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_etag_changes_with_data_reader_and_cursor(self):
+        index = reverse('index')
+        etag = self.client.get(index)['ETag']
+        self.assertNotEqual(self.client.get(index, {'page': 2})['ETag'], etag)
+        self.assertNotEqual(Client().get(index)['ETag'], etag)
+        Post.objects.create(text='new', author=self.author)
+        response = self.client.get(index, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_changes_post_etag(self):
+        url = reverse('post', args=[self.author.username, self.post.id])
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(text='c', author=self.user, post=self.post)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'c')
+
+    def test_follow_changes_profile_etag(self):
+        url = reverse('profile', args=[self.author.username])
+        etag = self.client.get(url)['ETag']
+        Follow.objects.create(user=self.user, author=self.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class TestGenerationRace(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="writer",
+                                               password='test')
+        self.post = Post.objects.create(text='text', author=self.author)
+
+    def test_bumped_again_after_commit(self):
+        with transaction.atomic():
+            self.post.save()
+            inside = [generations.get(generations.POST, self.post.id),
+                      generations.get(generations.FEED)]
+        self.assertNotEqual([generations.get(generations.POST, self.post.id),
+                             generations.get(generations.FEED)], inside)
+
+    def test_page_read_during_commit_not_cached(self):
+        real = views.get_cursor_page
+
+        def committed_meanwhile(*args, **kwargs):
+            page = real(*args, **kwargs)
+            generations.bump_post(self.post.id, self.author.id)
+            return page
+
+        with mock.patch.object(views, 'get_cursor_page', committed_meanwhile):
+            response = Client().get(reverse('index'))
+        self.assertTrue(response.context['generation'].startswith('once-'))
+        self.assertTrue(all(post.version.startswith('once-')
+                            for post in response.context['page']))
+        response = Client().get(reverse('index'))
+        self.assertIsInstance(response.context['generation'], int)
+
+
+class TestAnonymousPageCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="writer",
+                                               password='test')
+        Post.objects.create(text='первый пост', author=self.author)
+
+    def tearDown(self):
+        # блокировки и копии страниц не должны достаться другим тестам
+        cache.clear()
+
+    def get_counting(self, url='/'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries.captured_queries)
+
+    def test_repeated_page_served_from_cache(self):
+        response, _ = self.get_counting()
+        cached, count = self.get_counting()
+        self.assertEqual(count, 0)
+        self.assertEqual(cached.content, response.content)
+        etag = response['ETag']
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_requests_with_session_bypass_cache(self):
+        self.client.get('/')
+        self.client.force_login(self.author)
+        response, count = self.get_counting()
+        self.assertGreater(count, 0)
+        self.assertContains(response, 'writer')
+
+    def test_new_post_invalidates_pages(self):
+        self.client.get('/')
+        Post.objects.create(text='второй пост', author=self.author)
+        response, count = self.get_counting()
+        self.assertGreater(count, 0)
+        self.assertContains(response, 'второй пост')
+
+    def test_stale_copy_served_while_another_request_rebuilds(self):
+        self.client.get('/')
+        Post.objects.create(text='второй пост', author=self.author)
+        key = AnonymousPageCacheMiddleware(None).key(RequestFactory().get('/'))
+        cache.add(key + ':lock', 1)
+        response, count = self.get_counting()
+        self.assertEqual(count, 0)
+        self.assertNotContains(response, 'второй пост')
+
+    @override_settings(PAGE_CACHE_BETA=10 ** 9)
+    def test_early_refresh(self):
+        self.client.get('/')
+        _, count = self.get_counting()
+        self.assertGreater(count, 0)
+
+
+class TestFollowGraph(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="reader",
+                                               password='test')
+        self.author = User.objects.create_user(username="author",
+                                               password='test')
+        self.other = User.objects.create_user(username="other",
+                                              password='test')
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def test_answers_from_cache(self):
+        follow_graph.following(self.reader.pk)
+        follow_graph.follower_count(self.author.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                      self.author.pk))
+            self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                       self.other.pk))
+            self.assertEqual(follow_graph.following_count(self.reader.pk), 1)
+            self.assertEqual(follow_graph.follower_count(self.author.pk), 1)
+
+    def test_follow_and_unfollow_update_graph(self):
+        self.assertEqual(follow_graph.following(self.reader.pk),
+                         {self.author.pk})
+        self.assertEqual(follow_graph.follower_count(self.other.pk), 0)
+        Follow.objects.create(user=self.reader, author=self.other)
+        self.assertEqual(follow_graph.following(self.reader.pk),
+                         {self.author.pk, self.other.pk})
+        self.assertEqual(follow_graph.follower_count(self.other.pk), 1)
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertFalse(follow_graph.is_following(self.reader.pk,
+                                                   self.author.pk))
+        self.assertEqual(follow_graph.follower_count(self.author.pk), 0)
+
+    def test_reset_after_bulk_changes(self):
+        follow_graph.following(self.reader.pk)
+        Follow.objects.bulk_create([Follow(user=self.reader,
+                                           author=self.other)])
+        follow_graph.reset()
+        self.assertTrue(follow_graph.is_following(self.reader.pk,
+                                                  self.other.pk))
+
+    def test_anonymous_follows_nobody(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(follow_graph.is_following(None, self.author.pk))
+
+
+class TestCommentPages(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="author",
+                                               password='test')
+        self.post = Post.objects.create(text='text', author=self.author)
+        Comment.objects.bulk_create([
+            Comment(text=f'comment {i:02}', author=self.author,
+                    post=self.post)
+            for i in range(25)
+        ])
+        self.url = reverse('post', args=[self.author.username, self.post.id])
+
+    def test_first_page_and_fragment(self):
+        response = self.client.get(self.url)
+        page = response.context['comments']
+        self.assertEqual([c.text for c in page],
+                         [f'comment {i:02}' for i in range(20)])
+        self.assertTrue(page.next_cursor)
+        more = reverse('post_comments',
+                       args=[self.author.username, self.post.id])
+        self.assertContains(response, f'{more}?after={page.next_cursor}')
+
+        with self.assertNumQueries(1):
+            fragment = self.client.get(more, {'after': page.next_cursor})
+        self.assertContains(fragment, 'comment 24')
+        self.assertNotContains(fragment, 'comment 19')
+        self.assertNotContains(fragment, 'js-more-comments')
+
+    def test_authors_loaded_with_comments(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT "auth_user"')
+            for query in queries.captured_queries))
+
+    def test_new_comment_is_shown_after_redirect(self):
+        self.client.force_login(self.author)
+        response = self.client.post(
+            reverse('add_comment', args=[self.author.username, self.post.id]),
+            {'text': 'последний'}, follow=True)
+        self.assertEqual(response.context['comments'][0].text, 'последний')
+        # более ранние комментарии остаются достижимы
+        previous = response.context['comments'].previous_query
+        self.assertContains(response, f'{self.url}?{previous}')
+        response = self.client.get(f'{self.url}?{previous}')
+        self.assertEqual(response.context['comments'][0].text, 'comment 00')
+        more = reverse('post_comments',
+                       args=[self.author.username, self.post.id])
+        fragment = self.client.get(
+            more, {'after': response.context['comments'].next_cursor})
+        self.assertContains(fragment, 'последний')
+        self.assertNotContains(fragment, 'предыдущие')
+
+
+class TestJsonApi(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="author",
+                                               password='test')
+        self.reader = User.objects.create_user(username="reader",
+                                               password='test')
+        self.group = Group.objects.create(title='g', slug='g')
+        Post.objects.bulk_create([
+            Post(text=f'post {i:02}', author=self.author,
+                 group=self.group if i % 2 else None)
+            for i in range(15)
+        ])
+        self.post = Post.objects.order_by('-id').first()
+        Comment.objects.create(text='c', author=self.reader, post=self.post)
+
+    def test_index_pages_with_cursor(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/posts/').json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(data['results'][0]['author'], 'author')
+        self.assertEqual(data['results'][0]['comment_count'], 1)
+        self.assertIsNone(data['previous'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['next'])
+
+    def test_sparse_fields(self):
+        data = self.client.get('/api/posts/', {'fields': 'id,text'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'text'})
+        self.assertIn('fields=id%2Ctext', data['next'])
+        response = self.client.get('/api/posts/', {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_group_profile_and_post(self):
+        data = self.client.get('/api/group/g/').json()
+        self.assertEqual(len(data['results']), 7)
+        data = self.client.get('/api/author/').json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertEqual(self.client.get('/api/nobody/').status_code, 404)
+        data = self.client.get(f'/api/author/{self.post.id}/').json()
+        self.assertEqual(data['text'], self.post.text)
+        self.assertIsNone(data['image'])
+        data = self.client.get(f'/api/author/{self.post.id}/comments/').json()
+        self.assertEqual(data['results'][0]['author'], 'reader')
+
+    def test_follow_feed(self):
+        self.assertEqual(self.client.get('/api/follow/').status_code, 403)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+        data = self.client.get('/api/follow/', {'fields': 'text'}).json()
+        self.assertEqual([item['text'] for item in data['results']],
+                         [f'post {i:02}' for i in range(14, 4, -1)])
+
+
+@override_settings(LIVE_POLL_INTERVAL=0.01, LIVE_HEARTBEAT=5)
+class TestLiveUpdates(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def stream(self, query_string, publish=None, headers=()):
+        async def scenario():
+            sent = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'path': live.LIVE_PATH,
+                     'query_string': query_string, 'headers': list(headers)}
+            app = asyncio.ensure_future(live.application(scope, receive,
+                                                         send))
+            # первый опрос кэша запоминает текущие значения
+            await asyncio.sleep(0.05)
+            if publish is not None:
+                live.publish(publish)
+            for _ in range(100):
+                if any(b'event: post' in message.get('body', b'')
+                       for message in sent):
+                    break
+                await asyncio.sleep(0.01)
+            disconnected.set()
+            await app
+            return sent
+
+        return asyncio.run(scenario())
+
+    def test_new_post_reaches_index_stream(self):
+        post = SimpleNamespace(pk=42, author_id=1, group_id=None)
+        sent = self.stream(b'feed=index', publish=post)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'),
+                      sent[0]['headers'])
+        body = b''.join(message.get('body', b'') for message in sent)
+        self.assertIn(b'event: post\ndata: {"feed": "index", "post_id": 42}',
+                      body)
+
+    def test_group_feed_keys(self):
+        group = Group.objects.create(title='g', slug='g')
+        self.assertEqual(live.resolve_keys('group:g', {}),
+                         ['live:group:%s' % group.id])
+        with self.assertRaises(LookupError):
+            live.resolve_keys('group:missing', {})
+
+    def test_follow_feed_uses_session(self):
+        reader = User.objects.create_user(username="reader", password='t')
+        author = User.objects.create_user(username="author", password='t')
+        Follow.objects.create(user=reader, author=author)
+        with self.assertRaises(PermissionError):
+            live.resolve_keys('follow', {})
+        client = Client()
+        client.force_login(reader)
+        self.assertEqual(live.resolve_keys('follow', client.cookies),
+                         ['live:author:%s' % author.id])
+
+    def test_unknown_path_and_feed(self):
+        async def call(path, query_string):
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'path': path,
+                     'query_string': query_string, 'headers': []}
+            await live.application(scope, None, send)
+            return sent[0]['status']
+
+        self.assertEqual(asyncio.run(call('/', b'')), 404)
+        self.assertEqual(asyncio.run(call(live.LIVE_PATH, b'feed=x')), 404)
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for histogram in metrics.HISTOGRAMS:
+            histogram.reset()
+        self.client = Client()
+        author = User.objects.create_user(username="author", password='t')
+        Post.objects.create(text='text', author=author)
+
+    def test_histograms_per_view(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('profile', args=['author']))
+        self.client.get('/about-us/')
+        body = self.client.get('/metrics/').content.decode()
+        self.assertIn('yatube_request_seconds_count{view="index"} 1', body)
+        self.assertIn('yatube_request_seconds_bucket{view="profile",'
+                      'le="+Inf"} 1', body)
+        self.assertNotIn('view="about"', body)
+        self.assertNotIn('view="metrics"', body)
+        series = metrics.DB_QUERIES.series['index']
+        self.assertGreater(series[1], 0)
+        self.assertGreater(metrics.TEMPLATE_SECONDS.series['index'][1], 0)
+
+    def test_only_allowed_addresses(self):
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        # через прокси на том же адресе
+        response = self.client.get('/metrics/',
+                                   HTTP_X_FORWARDED_FOR='203.0.113.5')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        response = self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_cache_hits_counted(self):
+        for _ in range(3):
+            Client().get(reverse('index'))
+        body = self.client.get('/metrics/').content.decode()
+        self.assertIn('yatube_request_seconds_count{view="index"} 3', body)
+
+    @override_settings(SLOW_REQUEST_SECONDS=0, SLOW_REQUEST_SAMPLE_RATE=1)
+    def test_slow_requests_logged_with_sql(self):
+        with self.assertLogs('yatube.slow_requests') as logs:
+            self.client.get(reverse('index'))
+        self.assertIn('[index]', logs.output[0])
+        self.assertIn('FROM "posts_post"', logs.output[0])
+
+    @override_settings(SLOW_REQUEST_SECONDS=0, SLOW_REQUEST_SAMPLE_RATE=0)
+    def test_unsampled_requests_not_logged(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('yatube.slow_requests'):
+                self.client.get(reverse('index'))
+
+
+class TestWarmup(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.STARTUP_SECONDS.clear()
+        author = User.objects.create_user(username="author", password='t')
+        Post.objects.create(text='прогретый пост', author=author)
+
+    def tearDown(self):
+        cache.clear()
+        metrics.STARTUP_SECONDS.clear()
+
+    def test_production_settings(self):
+        from yatube import settings as base, settings_production
+
+        self.assertNotIn('debug_toolbar', settings_production.INSTALLED_APPS)
+        self.assertFalse([name for name in settings_production.MIDDLEWARE
+                          if name.startswith('debug_toolbar')])
+        self.assertNotIn('locmem',
+                         settings_production.CACHES['default']['BACKEND'])
+        loaders = settings_production.TEMPLATES[0]['OPTIONS']['loaders']
+        self.assertEqual(loaders[0][0],
+                         'django.template.loaders.cached.Loader')
+        # базовые настройки не изменились
+        self.assertTrue(base.TEMPLATES[0]['APP_DIRS'])
+        self.assertEqual(base.DATABASES['default']['ENGINE'],
+                         'django.db.backends.sqlite3')
+
+    def test_warm_up_fills_caches_and_reports_timings(self):
+        from django.core.wsgi import get_wsgi_application
+        from yatube import warmup
+
+        # django.setup() внутри заново настраивает журналы
+        application = get_wsgi_application()
+        with self.assertLogs('yatube.startup') as logs:
+            timings = warmup.warm_up(application, started=0)
+        self.assertEqual(
+            set(timings), {'setup', 'templates', 'urls', 'translations',
+                           'caches', 'pages', 'total'})
+        self.assertIn('pages', logs.output[0])
+        self.assertGreaterEqual(warmup.compile_templates(), 20)
+        self.assertEqual(metrics.REQUEST_SECONDS.series, {})
+        # фрагменты прогреты, а целые страницы под служебным адресом
+        # в кэш не попали
+        key = make_template_fragment_key(
+            'index_page', [generations.get(generations.FEED), None, '', '', ''])
+        self.assertTrue(cache.get(key))
+        self.assertFalse([key for key in cache._cache if ':page:' in key])
+        response = Client().get(reverse('index'))
+        self.assertContains(response, 'прогретый пост')
+        body = Client().get('/metrics/').content.decode()
+        self.assertIn('yatube_startup_seconds{step="pages"}', body)
+
+
+class TestReferenceCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.group = Group.objects.create(title='Котики', slug='cats')
+        self.page = FlatPage.objects.create(
+            url='/about-us/', title='О нас', content='первая версия')
+        self.page.sites.add(settings.SITE_ID)
+
+    def test_group_loaded_once(self):
+        self.assertEqual(reference.group('cats').title, 'Котики')
+        self.assertIsNone(reference.group('dogs'))
+        with self.assertNumQueries(0):
+            self.assertEqual(reference.group('cats'), self.group)
+            self.assertIsNone(reference.group('dogs'))
+        self.group.title = 'Коты'
+        self.group.save()
+        response = self.client.get(reverse('groups', args=['cats']))
+        self.assertContains(response, 'Коты')
+        self.group.delete()
+        response = self.client.get(reverse('groups', args=['cats']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_flatpage_without_queries(self):
+        self.assertContains(self.client.get('/about-us/'), 'первая версия')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get('/about-us/'),
+                                'первая версия')
+        self.page.content = 'вторая версия'
+        self.page.save()
+        self.assertContains(self.client.get('/about-us/'), 'вторая версия')
+        self.page.sites.clear()
+        self.assertEqual(self.client.get('/about-us/').status_code, 404)
+
+    def test_misses_bounded(self):
+        with mock.patch.object(reference, 'MAX_MISSES', 2):
+            for slug in ('a', 'b', 'c'):
+                self.assertIsNone(reference.group(slug))
+            with self.assertNumQueries(0):
+                reference.group('c')
+            self.assertEqual(list(reference._misses),
+                             [('group', 'b'), ('group', 'c')])
+            with self.assertNumQueries(1):
+                reference.group('a')
+
+    def test_version_shared_between_processes(self):
+        reference.group('cats')
+        # другой процесс изменил группу: у нас лишь новый номер в кэше
+        Group.objects.filter(pk=self.group.pk).update(title='Коты')
+        self.assertEqual(reference.group('cats').title, 'Котики')
+        generations.bump(generations.REFERENCE)
+        self.assertEqual(reference.group('cats').title, 'Коты')
+
+
+class TestCachedAuth(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="reader", password='test')
+        self.client = Client()
+        self.client.login(username='reader', password='test')
+
+    def auth_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query['sql'] for query in queries.captured_queries
+                          if 'django_session' in query['sql']
+                          or 'FROM "auth_user" WHERE "auth_user"."id"'
+                          in query['sql']]
+
+    def test_session_and_user_from_cache(self):
+        self.auth_queries(reverse('follow_index'))
+        response, queries = self.auth_queries(reverse('follow_index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    def test_user_changes_invalidate_cache(self):
+        self.auth_queries(reverse('index'))
+        self.user.first_name = 'Читатель'
+        self.user.save()
+        response, queries = self.auth_queries(reverse('index'))
+        self.assertEqual(response.context['user'].first_name, 'Читатель')
+        self.assertEqual(len(queries), 1)
+
+        # после смены пароля старая сессия больше не действует
+        self.user.set_password('new password')
+        self.user.save()
+        response = self.client.get(reverse('follow_index'))
+        self.assertRedirects(
+            response, f"{reverse('login')}?next={reverse('follow_index')}")
+
+
+    def test_deploy_check_requires_shared_cache(self):
+        from users.checks import check_shared_session_cache
+
+        ids = [error.id for error in check_shared_session_cache(None)]
+        self.assertEqual(ids, ['users.E001', 'users.E002'])
+        shared = {'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': '127.0.0.1:11211'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_shared_session_cache(None), [])
+        with override_settings(
+                SESSION_ENGINE='django.contrib.sessions.backends.db',
+                AUTHENTICATION_BACKENDS=[
+                    'django.contrib.auth.backends.ModelBackend']):
+            self.assertEqual(check_shared_session_cache(None), [])
+
+
+class TestUsernameCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="leo", password='t')
+        self.post = Post.objects.create(text='пост', author=self.author)
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def username_joins(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries
+                if '"auth_user"."username" =' in query['sql']]
+
+    def test_post_fetched_by_primary_key(self):
+        url = reverse('post', args=['leo', self.post.id])
+        self.username_joins(url)
+        self.assertEqual(self.username_joins(url), [])
+        self.assertEqual(
+            self.username_joins(reverse('post_comments',
+                                        args=['leo', self.post.id])), [])
+        self.assertEqual(self.username_joins(reverse('profile',
+                                                     args=['leo'])), [])
+        other = User.objects.create_user(username="kate", password='t')
+        response = self.client.get(reverse('post', args=['kate',
+                                                         self.post.id]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(usernames.user_id('kate'), other.id)
+
+    def test_rename_and_new_users(self):
+        self.client.get(reverse('profile', args=['leo']))
+        self.author.username = 'leon'
+        self.author.save()
+        self.assertEqual(
+            self.client.get(reverse('profile', args=['leo'])).status_code,
+            404)
+        self.assertEqual(
+            self.client.get(reverse('post', args=['leon', self.post.id]))
+            .status_code, 200)
+
+        # отсутствующее имя тоже кэшируется до регистрации пользователя
+        follow_url = reverse('profile_follow', args=['mia'])
+        self.assertEqual(self.client.get(follow_url).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertIsNone(usernames.user_id('mia'))
+        mia = User.objects.create_user(username="mia", password='t')
+        self.client.get(follow_url)
+        self.assertTrue(Follow.objects.filter(user=self.author,
+                                              author=mia).exists())
+
+    def test_rename_refreshes_cached_links(self):
+        other = User.objects.create_user(username="kate", password='t')
+        commented = Post.objects.create(text='чужой', author=other)
+        Comment.objects.create(text='ответ', author=self.author,
+                               post=commented)
+        guest = Client()
+        post_url = reverse('post', args=['kate', commented.id])
+        self.assertContains(guest.get(reverse('index')),
+                            reverse('post', args=['leo', self.post.id]))
+        etag = self.client.get(post_url)['ETag']
+        self.author.username = 'leon'
+        self.author.save()
+        response = guest.get(reverse('index'))
+        self.assertContains(response,
+                            reverse('post', args=['leon', self.post.id]))
+        self.assertNotContains(response, '/leo/')
+        response = self.client.get(post_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '/leon/')
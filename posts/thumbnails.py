@@ -0,0 +1,166 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBKVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from . import generations
+
+logger = logging.getLogger(__name__)
+
+# миниатюра карточки поста в лентах
+FEED_GEOMETRY = '960x339'
+FEED_OPTIONS = {'crop': 'center', 'upscale': True}
+# как долго не ставить повторно в очередь одну и ту же картинку
+ATTEMPT_TIMEOUT = 60 * 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class FeedThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, умеющий искать готовую миниатюру без её создания."""
+
+    def thumbnail_file(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        # те же опции по умолчанию, что и в ThumbnailBackend.get_thumbnail,
+        # чтобы имя файла совпадало с созданным тегом {% thumbnail %}
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def get_ready_thumbnail(self, file_, geometry_string, **options):
+        """Готовая миниатюра из KVStore или None."""
+        if not file_:
+            return None
+        return default.kvstore.get(
+            self.thumbnail_file(file_, geometry_string, **options))
+
+
+backend = FeedThumbnailBackend()
+
+
+def ready_feed_thumbnail(image):
+    return backend.get_ready_thumbnail(image, FEED_GEOMETRY, **FEED_OPTIONS)
+
+
+def ready_feed_thumbnails(images):
+    """Готовые миниатюры для списка картинок за одно обращение к хранилищу.
+
+    Возвращает словарь {имя картинки: ImageFile или None}. Для KVStore
+    cached_db ключи читаются одним cache.get_many(), а промахи — одним
+    запросом к БД; для других хранилищ остаётся поштучный поиск.
+    """
+    names = {image.name if hasattr(image, 'name') else image
+             for image in images if image}
+    kvstore = default.kvstore
+    if not isinstance(kvstore, CachedDBKVStore):
+        return {name: ready_feed_thumbnail(name) for name in names}
+
+    raw_keys = {
+        add_prefix(backend.thumbnail_file(
+            name, FEED_GEOMETRY, **FEED_OPTIONS).key): name
+        for name in names
+    }
+    values = kvstore.cache.get_many(list(raw_keys))
+    missing = [key for key in raw_keys if key not in values]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(key__in=missing)
+                      .values_list('key', 'value'))
+        fetched = {key: stored.get(key, EMPTY_VALUE) for key in missing}
+        kvstore.cache.set_many(fetched,
+                               thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {
+        name: (None if values[key] == EMPTY_VALUE
+               else deserialize_image_file(values[key]))
+        for key, name in raw_keys.items()
+    }
+
+
+def prefetch_feed_images(posts):
+    """Проставляет постам страницы адреса картинок до рендеринга."""
+    posts = [post for post in posts if post.image]
+    ready = ready_feed_thumbnails([post.image for post in posts])
+    for post in posts:
+        thumbnail = ready.get(post.image.name)
+        if thumbnail is None:
+            schedule(post)
+            post.image_url = post.image.url
+        else:
+            post.image_url = thumbnail.url
+
+
+def generate(post_id):
+    """Создаёт миниатюру поста и сбрасывает кэш его карточки."""
+    from .models import Post
+
+    try:
+        post = (Post.objects.filter(pk=post_id)
+                .values_list('image', 'author_id', 'group_id').first())
+        if post is None or not post[0]:
+            return False
+        image, author_id, group_id = post
+        backend.get_thumbnail(image, FEED_GEOMETRY, **FEED_OPTIONS)
+        if ready_feed_thumbnail(image) is None:
+            return False
+        generations.bump_post(post_id, author_id, group_id)
+        return True
+    except Exception:
+        logger.exception('Не удалось создать миниатюру поста %s', post_id)
+        return False
+
+
+def generate_in_worker(post_id):
+    try:
+        return generate(post_id)
+    finally:
+        # у каждого потока пула своё соединение с БД
+        connection.close()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def schedule(post):
+    """Ставит создание миниатюры в очередь локального пула потоков.
+
+    Задача уходит в пул после коммита транзакции; при
+    THUMBNAIL_WORKERS = 0 миниатюра создаётся сразу.
+    """
+    if not post.image:
+        return
+    if not cache.add('thumbnail-attempt:%s' % post.image.name, 1,
+                     ATTEMPT_TIMEOUT):
+        return
+    post_id = post.pk
+    if not getattr(settings, 'THUMBNAIL_WORKERS', 0):
+        transaction.on_commit(lambda: generate(post_id))
+    else:
+        transaction.on_commit(
+            lambda: _get_executor().submit(generate_in_worker, post_id))
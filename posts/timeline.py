@@ -0,0 +1,158 @@
+import heapq
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import follow_graph
+from .models import Follow, Post, TimelineEntry, UserCounters
+from .paginator import POSTS_PER_PAGE, KeyedCursorPaginator, paginate
+
+BATCH_SIZE = 1000
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 1000)
+
+
+def backfill_size():
+    return getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+
+
+def is_fanned_out(author_id):
+    return follow_graph.follower_count(author_id) <= fanout_limit()
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if not is_fanned_out(post.author_id):
+        return
+    follower_ids = (Follow.objects.filter(author_id=post.author_id)
+                    .values_list('user_id', flat=True))
+    batch = []
+    for user_id in follower_ids.iterator():
+        batch.append(TimelineEntry(user_id=user_id, post_id=post.pk,
+                                   author_id=post.author_id,
+                                   pub_date=post.pub_date))
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    recent = (Post.objects.filter(author_id=author_id)
+              .order_by('-pub_date', '-id')
+              .values_list('pk', 'pub_date')[:backfill_size()])
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, post_id=pk, author_id=author_id,
+                      pub_date=pub_date)
+        for pk, pub_date in recent
+    ], ignore_conflicts=True)
+
+
+def _insert_recent(author_id=None):
+    """Последние backfill_size() постов автора — в ленты всех его
+    подписчиков, одним INSERT … SELECT; без author_id — всех авторов."""
+    ops = connection.ops
+    posts_filter = follows_filter = ''
+    posts_params, follows_params = [], []
+    if author_id is not None:
+        posts_filter = 'WHERE author_id = %s'
+        follows_filter = 'AND follow.author_id = %s'
+        posts_params = follows_params = [author_id]
+    sql = (
+        '{insert} {entries} (user_id, post_id, author_id, pub_date) '
+        'SELECT follow.user_id, recent.id, recent.author_id, recent.pub_date '
+        'FROM {follows} follow JOIN ('
+        '  SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+        '    PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+        '  ) AS position FROM {posts} {posts_filter}'
+        ') recent ON recent.author_id = follow.author_id '
+        'AND recent.position <= %s {follows_filter} {suffix}'
+    ).format(insert=ops.insert_statement(ignore_conflicts=True),
+             entries=TimelineEntry._meta.db_table,
+             follows=Follow._meta.db_table,
+             posts=Post._meta.db_table,
+             posts_filter=posts_filter,
+             follows_filter=follows_filter,
+             suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=True))
+    with connection.cursor() as cursor:
+        cursor.execute(sql,
+                       posts_params + [backfill_size()] + follows_params)
+
+
+def catch_up(author_id):
+    """Раскладывает посты автора, когда подписчиков снова не больше лимита.
+
+    Пока автор был выше лимита, его новые посты не раскладывались, а
+    подмешивались при чтении. Ниже лимита подмешивание прекращается,
+    поэтому при переходе через границу последние посты автора
+    добавляются в ленты всех его подписчиков.
+    """
+    followers = (UserCounters.objects.filter(user_id=author_id)
+                 .values_list('followers', flat=True).first())
+    if followers == fanout_limit():
+        _insert_recent(author_id)
+
+
+def remove(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild():
+    """Заполняет ленты заново по текущим подпискам.
+
+    Два запроса в одной транзакции: читатели до коммита видят прежние
+    ленты, а не пустые.
+    """
+    with transaction.atomic():
+        TimelineEntry.objects.all().delete()
+        _insert_recent()
+
+
+class TimelinePaginator(KeyedCursorPaginator):
+    """Лента подписок из материализованной таблицы.
+
+    Ключи страницы читаются из TimelineEntry по индексу
+    (user, pub_date, post) и сливаются с постами популярных авторов,
+    которые при записи не раскладывались. Сами посты загружаются
+    одним запросом по списку id.
+    """
+
+    def __init__(self, user, per_page=POSTS_PER_PAGE, posts=None):
+        self.entries = (TimelineEntry.objects.filter(user=user)
+                        .order_by('-pub_date', '-post_id'))
+        counts = follow_graph.follower_counts(follow_graph.following(user.pk))
+        self.extra_authors = sorted(author_id
+                                    for author_id, count in counts.items()
+                                    if count > fanout_limit())
+        if posts is None:
+            posts = Post.objects.for_feed()
+        super().__init__(posts, per_page)
+        self.base_posts = self.object_list.order_by(*self.ordering)
+
+    def _fetch_keys(self, key, forward, limit):
+        sources = [list(
+            self._seek(key, forward, self.entries, ('pub_date', 'post_id'))
+            .values_list('pub_date', 'post_id')[:limit]
+        )]
+        if self.extra_authors:
+            extra = self.base_posts.filter(author_id__in=self.extra_authors)
+            sources.append(list(
+                self._seek(key, forward, extra)
+                .values_list(*self.fields)[:limit]
+            ))
+        keys = []
+        for item in heapq.merge(*sources,
+                                reverse=self.descending == forward):
+            if keys and keys[-1] == item:
+                continue
+            keys.append(item)
+            if len(keys) == limit:
+                break
+        return keys
+
+
+def get_timeline_page(request, user, per_page=POSTS_PER_PAGE):
+    return paginate(request, TimelinePaginator(user, per_page))
@@ -0,0 +1,192 @@
+"""Перенос данных между окружениями построчным JSON (JSONL).
+
+Каждая строка — одна запись: {"model": "post", ...поля}. Модели идут
+в порядке зависимостей: группы, пользователи, посты, комментарии,
+подписки. Пользователи в ссылках записываются именем, поэтому их id в
+разных базах могут не совпадать; id групп, постов и комментариев
+сохраняются, поэтому загружать их можно только в базу, где их ещё нет:
+иначе комментарии из файла прицепились бы к чужим постам с теми же id.
+Пользователи и подписки, которые уже есть, пропускаются.
+"""
+import datetime
+import json
+from contextlib import contextmanager
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from . import follow_graph, generations, reference, timeline, usernames
+from .models import Comment, Follow, Group, Post, User, UserCounters
+
+EXPORTS = (
+    ('group', Group.objects.order_by('pk'),
+     ('id', 'title', 'slug', 'description')),
+    ('user', User.objects.order_by('pk'),
+     ('username', 'password', 'first_name', 'last_name', 'email',
+      'is_active', 'date_joined')),
+    ('post', Post.objects.order_by('pk'),
+     ('id', 'text', 'pub_date', 'author__username', 'group_id', 'image')),
+    ('comment', Comment.objects.order_by('pk'),
+     ('id', 'text', 'created', 'author__username', 'post_id')),
+    ('follow', Follow.objects.order_by('pk'),
+     ('user__username', 'author__username')),
+)
+
+
+class Encoder(DjangoJSONEncoder):
+
+    def default(self, o):
+        # DjangoJSONEncoder обрезает время до миллисекунд
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def export_rows(chunk_size=2000):
+    """Строки JSONL всех моделей; в памяти держится одна пачка записей."""
+    encoder = Encoder(ensure_ascii=False)
+    for model, queryset, fields in EXPORTS:
+        names = [field.split('__')[0] for field in fields]
+        rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+        for row in rows:
+            record = dict(zip(names, row))
+            record['model'] = model
+            yield encoder.encode(record)
+
+
+@contextmanager
+def keep_dates():
+    """Не подменять даты из файла текущим временем (auto_now_add)."""
+    fields = [Post._meta.get_field('pub_date'),
+              Comment._meta.get_field('created')]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class TargetNotEmpty(Exception):
+    """В базе уже есть строки с id, которые импорт сохраняет."""
+
+
+class Importer:
+    """Импорт пачками bulk_create, по транзакции на пачку.
+
+    bulk_create не отправляет сигналы моделей, поэтому счётчики, ленты
+    подписок и поколения кэша не обновляются на каждой строке, а
+    пересчитываются один раз в finish().
+    """
+
+    def __init__(self, batch_size=2000):
+        self.batch_size = batch_size
+        self.user_ids = {}
+        self.author_ids = set()
+        self.group_ids = set()
+        self.loaded = dict.fromkeys([name for name, _, _ in EXPORTS], 0)
+        self.model = None
+        self.batch = []
+
+    def check_target(self):
+        for model in (Group, Post, Comment):
+            if model.objects.exists():
+                raise TargetNotEmpty(
+                    'В базе уже есть записи %s; импорт сохраняет id и '
+                    'загружается только в пустую базу'
+                    % model._meta.model_name)
+
+    def load(self, lines):
+        self.check_target()
+        with keep_dates():
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                model = record.pop('model')
+                if model != self.model or len(self.batch) >= self.batch_size:
+                    self.flush()
+                    self.model = model
+                self.batch.append(record)
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        build = getattr(self, 'build_%s' % self.model)
+        with transaction.atomic():
+            objects = build(self.batch)
+            # размер одного INSERT Django подберёт под ограничения базы
+            type(objects[0]).objects.bulk_create(objects,
+                                                 ignore_conflicts=True)
+            if self.model == 'user':
+                self.remember_users(obj.username for obj in objects)
+        self.loaded[self.model] += len(self.batch)
+        self.batch = []
+
+    def remember_users(self, names):
+        self.user_ids.update(User.objects.filter(username__in=list(names))
+                             .values_list('username', 'pk'))
+
+    def user_id(self, username):
+        if username not in self.user_ids:
+            # пользователь мог быть в базе до импорта
+            self.remember_users([username])
+        return self.user_ids[username]
+
+    def build_group(self, records):
+        return [Group(**record) for record in records]
+
+    def build_user(self, records):
+        return [User(**dict(record,
+                            date_joined=parse_datetime(record['date_joined'])))
+                for record in records]
+
+    def build_post(self, records):
+        posts = []
+        for record in records:
+            author_id = self.user_id(record['author'])
+            self.author_ids.add(author_id)
+            self.group_ids.add(record['group_id'])
+            posts.append(Post(
+                id=record['id'], text=record['text'],
+                pub_date=parse_datetime(record['pub_date']),
+                author_id=author_id, group_id=record['group_id'],
+                image=record['image'] or None))
+        return posts
+
+    def build_comment(self, records):
+        return [Comment(id=record['id'], text=record['text'],
+                        created=parse_datetime(record['created']),
+                        author_id=self.user_id(record['author']),
+                        post_id=record['post_id'])
+                for record in records]
+
+    def build_follow(self, records):
+        return [Follow(user_id=self.user_id(record['user']),
+                       author_id=self.user_id(record['author']))
+                for record in records]
+
+    def finish(self):
+        # у загруженных имён мог быть закэширован промах
+        usernames.forget(*self.user_ids)
+        rebuild_derived(self.author_ids, self.group_ids, self.batch_size)
+
+
+def rebuild_derived(author_ids=(), group_ids=(), batch_size=2000):
+    """Один раз пересчитывает всё, что выводится из загруженных строк.
+
+    Нужна после массовой загрузки через bulk_create, которая не
+    отправляет сигналы моделей.
+    """
+    UserCounters.objects.rebuild(batch_size=batch_size)
+    follow_graph.reset()
+    reference.invalidate()
+    timeline.rebuild()
+    scopes = [(generations.FEED, None)]
+    scopes.extend((generations.AUTHOR, pk) for pk in author_ids)
+    scopes.extend((generations.GROUP, pk) for pk in group_ids)
+    generations.bump_many(scopes)
@@ -10,6 +10,7 @@ urlpatterns = [
           views.profile_unfollow, name="profile_unfollow"),
     path("group/<slug:slug>/", views.group_posts, name='groups'),
     path("new/", views.new_post, name='new_post'),
+    path("search/", views.search, name='search'),
     path('<str:username>/', views.profile, name='profile'),
     path(
         '<str:username>/<int:post_id>/',
@@ -20,6 +21,8 @@ urlpatterns = [
         views.post_edit,
         name='post_edit'
     ),
+    path('<str:username>/<int:post_id>/comments/',
+         views.post_comments, name='post_comments'),
     path("<username>/<int:post_id>/comment",
          views.add_comment, name="add_comment"),
 ]
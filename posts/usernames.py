@@ -0,0 +1,69 @@
+"""Кэш «имя пользователя → id» для адресов вида /<username>/<post_id>/.
+
+Если id автора уже в кэше, пост ищется по первичному ключу с проверкой
+author_id, а не соединением с auth_user по строковому столбцу. При
+промахе остаётся прежний запрос по имени, а id из найденной строки
+запоминается, поэтому лишних запросов нет и на холодном кэше. Записи
+сбрасываются сигналами при создании, переименовании и удалении
+пользователя.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import get_object_or_404 as _get_object_or_404
+
+from .models import User
+
+# имя без пользователя: None в кэше не отличить от промаха, а по id 0
+# ничего не найдётся
+MISSING = 0
+
+
+def _key(username):
+    return 'username-id:%s' % username
+
+
+def lookup(username, relation=None):
+    """Условие filter() для пользователя или для связи relation с ним.
+
+    lookup('leo') — {'pk': id} или {'username': 'leo'};
+    lookup('leo', 'author') — {'author_id': id} или
+    {'author__username': 'leo'}.
+    """
+    user_id = cache.get(_key(username))
+    if relation is None:
+        return {'username': username} if user_id is None else {'pk': user_id}
+    if user_id is None:
+        return {relation + '__username': username}
+    return {relation + '_id': user_id}
+
+
+def remember(username, user_id):
+    cache.set(_key(username), user_id, timeout=None)
+
+
+def get_object_or_404(queryset, username, relation=None, **kwargs):
+    """get_object_or_404 с условием lookup(); запоминает id автора."""
+    condition = lookup(username, relation)
+    obj = _get_object_or_404(queryset, **condition, **kwargs)
+    if next(iter(condition)).endswith('username'):
+        remember(username, obj.pk if relation is None
+                 else getattr(obj, relation + '_id'))
+    return obj
+
+
+def user_id(username):
+    """id пользователя с этим именем или None."""
+    value = cache.get(_key(username))
+    if value is None:
+        value = (User.objects.filter(username=username)
+                 .values_list('id', flat=True).first()) or MISSING
+        remember(username, value)
+    return value or None
+
+
+def forget(*usernames):
+    """Сбрасывает записи имён; второй раз — после коммита, на случай,
+    если параллельный запрос успел загрузить старые данные."""
+    keys = [_key(username) for username in usernames if username]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
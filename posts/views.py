@@ -1,31 +1,154 @@
-from django.shortcuts import render, get_object_or_404
-from .models import Post, Group, User, Comment, Follow
+import hashlib
+
+from django.shortcuts import render, reverse
+from .models import Post, User, Comment, Follow
+from . import follow_graph, generations, reference, thumbnails, usernames
 from .forms import PostForm, CommentForm
+from .paginator import COMMENTS_PER_PAGE, CursorPaginator, get_cursor_page
+from .search import search_page
+from .timeline import get_timeline_page
 from django.shortcuts import redirect
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.contrib.flatpages.views import render_flatpage
+from django.http import Http404, HttpResponsePermanentRedirect
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.views.decorators.http import condition
+
+
+def _begin(request):
+    """Номер PAGES до первого запроса страницы к базе."""
+    if not hasattr(request, 'page_generation'):
+        request.page_generation = generations.get(generations.PAGES)
+    return request.page_generation
+
+
+def _changed(request):
+    """Менялись ли данные, пока страница их читала.
+
+    Номера поколений читаются после запросов к базе. Если между ними
+    закоммитилось чужое изменение, строки могут быть старыми, а номера —
+    уже новыми; PAGES увеличивается раньше остальных номеров, поэтому
+    такое совпадение видно по нему.
+    """
+    return generations.get(generations.PAGES) != _begin(request)
+
+
+def _etag(request, *parts):
+    """ETag страницы из номеров поколений её данных.
+
+    Страница зависит ещё от читателя и от курсора в адресе, поэтому они
+    тоже входят в ETag. Если данные менялись во время чтения, ETag нет.
+    """
+    if _changed(request):
+        return None
+    parts += (request.user.pk, request.GET.urlencode())
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _prefetch(request, page, generation=None):
+    """Версии карточек и картинки страницы; возвращает номер поколения
+    для кэша её фрагмента.
+
+    Если данные менялись во время чтения, фрагменты пишутся под
+    одноразовыми номерами и другим читателям не достанутся.
+    """
+    generations.prefetch_post_versions(page)
+    thumbnails.prefetch_feed_images(page)
+    if _changed(request):
+        generation = generations.one_shot()
+        for post in page:
+            post.version = generations.one_shot()
+    return generation
+
+
+# объект страницы загружается один раз: для ETag и для самой страницы
+
+def _group(request, slug):
+    if not hasattr(request, 'page_group'):
+        _begin(request)
+        request.page_group = reference.group(slug)
+        if request.page_group is None:
+            raise Http404('Нет группы %s' % slug)
+    return request.page_group
+
+
+def _author(request, username):
+    if not hasattr(request, 'page_author'):
+        _begin(request)
+        request.page_author = usernames.get_object_or_404(
+            User.objects.select_related('counters'), username)
+    return request.page_author
+
 
+def _post(request, username, post_id):
+    if not hasattr(request, 'page_post'):
+        _begin(request)
+        request.page_post = usernames.get_object_or_404(
+            Post.objects.for_feed().select_related('author__counters'),
+            username, 'author', id=post_id)
+    return request.page_post
 
+
+def index_etag(request):
+    _begin(request)
+    return _etag(request, 'index', generations.get(generations.FEED))
+
+
+def group_etag(request, slug):
+    group = _group(request, slug)
+    return _etag(request, 'group', group.id,
+                 generations.get(generations.GROUP, group.id))
+
+
+def profile_etag(request, username):
+    author = _author(request, username)
+    return _etag(request, 'profile', author.id,
+                 generations.get(generations.AUTHOR, author.id))
+
+
+def post_etag(request, username, post_id):
+    post = _post(request, username, post_id)
+    return _etag(request, 'post', post.id,
+                 generations.get(generations.POST, post.id),
+                 generations.get(generations.AUTHOR, post.author_id))
+
+
+@condition(etag_func=index_etag)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    _begin(request)
+    generation = generations.get(generations.FEED)
+    post_list = Post.objects.for_feed()
+    page, paginator = get_cursor_page(request, post_list)
     return render(
         request,
         'index.html',
-        {'page': page, 'paginator': paginator}
+        {'page': page,
+         'paginator': paginator,
+         'generation': _prefetch(request, page, generation)}
     )
 
 
+@condition(etag_func=group_etag)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all().order_by("-pub_date")
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    group = _group(request, slug)
+    generation = generations.get(generations.GROUP, group.id)
+    posts = group.posts.for_feed()
+    page, paginator = get_cursor_page(request, posts)
     return render(request, "group.html", {
-                  "group": group, 'page': page, 'paginator': paginator})
+                  "group": group, 'page': page, 'paginator': paginator,
+                  'generation': _prefetch(request, page, generation)})
+
+
+def search(request):
+    query = request.GET.get('q', '').strip()
+    _begin(request)
+    page, paginator = search_page(request, query)
+    if page is not None:
+        _prefetch(request, page)
+    return render(request, 'search.html', {'query': query,
+                                           'page': page,
+                                           'paginator': paginator})
 
 
 @login_required
@@ -34,54 +157,90 @@ def new_post(request):
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        # счётчики автора и ленты подписчиков обновляются сигналами
+        # в той же транзакции
+        with transaction.atomic():
+            post.save()
+            thumbnails.schedule(post)
         return redirect('index')
     return render(request, 'new_post.html', {'form': form})
 
 
 @login_required
 def add_comment(request,username,post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    post = usernames.get_object_or_404(Post, username, 'author', id=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
         comment.save()
-        return redirect('post', username = username, post_id = post_id)
+        # на длинной ветке новый комментарий не попадёт на первую страницу,
+        # поэтому страница комментариев начинается с него
+        cursor = CursorPaginator.encode_key((comment.created, comment.id - 1))
+        return redirect('%s?after=%s#comment_%s' % (
+            reverse('post', args=[username, post_id]), cursor, comment.id))
     return redirect('post', username = username, post_id = post_id)
 
 
+@condition(etag_func=profile_etag)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    following = request.user.is_authenticated and Follow.objects.filter(author__username=username, user=request.user).exists()
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = _author(request, username)
+    following = follow_graph.is_following(request.user.pk, author.pk)
+    generation = generations.get(generations.AUTHOR, author.id)
+    post_list = author.posts.for_feed()
+    page, paginator = get_cursor_page(request, post_list)
     return render(request, 'profile.html', {
         'page': page,
         'paginator': paginator,
         'author': author,
-        'following': following
+        'following': following,
+        'generation': _prefetch(request, page, generation)
     })
 
 
+def _comments_page(request, comments):
+    # по времени добавления, с авторами в том же запросе
+    return get_cursor_page(request, comments.select_related('author'),
+                           COMMENTS_PER_PAGE, ordering=('created', 'id'))
+
+
+@condition(etag_func=post_etag)
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
+    post = _post(request, username, post_id)
+    page, paginator = _comments_page(request, post.comments.all())
+    _prefetch(request, [post])
     form = CommentForm()
-    return render(request, 'post.html', {'author': post.author,
-                                         'post': post,
-                                         'form': form})
+    return render(request, 'post.html', {
+        'author': post.author,
+        'post': post,
+        'comments': page,
+        # весь список как ленивый QuerySet; шаблон его не перебирает
+        'comment_list': paginator.object_list,
+        'comments_url': reverse('post_comments', args=[username, post_id]),
+        'post_url': request.path,
+        'form': form})
+
+
+def post_comments(request, username, post_id):
+    """Следующая страница комментариев поста фрагментом HTML."""
+    comments = Comment.objects.filter(
+        post_id=post_id, **usernames.lookup(username, 'post__author'))
+    page, _ = _comments_page(request, comments)
+    return render(request, 'basic/comment_list.html', {
+        'comments': page,
+        'comments_url': request.path})
 
 
 def post_edit(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id, author__username=username)
-    if request.user != post.author:
-        return redirect('post', username=author.username, post_id=post_id)
+    post = usernames.get_object_or_404(Post, username, 'author', id=post_id)
+    if request.user.pk != post.author_id:
+        return redirect('post', username=username, post_id=post_id)
     form = PostForm(request.POST or None, files=request.FILES or None, instance=post)
     if form.is_valid():
         post = form.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post)
         return redirect('post',
                         username=request.user.username,
                         post_id=post_id)
@@ -95,34 +254,48 @@ def post_edit(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(
-        author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    _begin(request)
+    page, paginator = get_timeline_page(request, request.user)
+    _prefetch(request, page)
     return render(request, "follow.html",{'page': page,
                                          'paginator': paginator})
 
 
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
-    is_follow = Follow.objects.filter(author__username=username,
-                                       user=request.user).exists()
-    if request.user != author and not is_follow:
-        Follow.objects.create(author=author,
-                                        user=request.user)
+    author_id = usernames.user_id(username)
+    if author_id is None:
+        raise Http404('Нет пользователя %s' % username)
+    is_follow = follow_graph.is_following(request.user.pk, author_id)
+    if request.user.pk != author_id and not is_follow:
+        with transaction.atomic():
+            Follow.objects.create(author_id=author_id,
+                                  user=request.user)
     return redirect('index')
 
 
 @login_required
 def profile_unfollow(request, username):
-    is_follow = Follow.objects.filter(author__username=username, user=request.user)
-    if is_follow.exists():
-        is_follow.delete()
+    # отдельная проверка подписки не нужна: delete() сам найдёт строку
+    Follow.objects.filter(**usernames.lookup(username, 'author'),
+                          user=request.user).delete()
     return redirect('index')
 
 
+def flatpage(request, url):
+    """django.contrib.flatpages.views.flatpage без запросов к базе."""
+    if not url.startswith('/'):
+        url = '/' + url
+    site_id = reference.current_site().id
+    page = reference.flatpage(url, site_id)
+    if page is None:
+        if (not url.endswith('/') and settings.APPEND_SLASH
+                and reference.flatpage(url + '/', site_id) is not None):
+            return HttpResponsePermanentRedirect('%s/' % request.path)
+        raise Http404('Нет страницы %s' % url)
+    return render_flatpage(request, page)
+
+
 def page_not_found(request, exception):
     return render(
         request, 
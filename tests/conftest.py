@@ -1,4 +1,21 @@
+import pytest
+
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.fixture(autouse=True)
+def synchronous_thumbnails(settings):
+    # фоновый поток миниатюр не должен писать в базу во время её очистки
+    # после тестов с transaction=True
+    settings.THUMBNAIL_WORKERS = 0
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # id строк повторяются после очистки базы, поэтому закэшированные по
+    # id данные (граф подписок, страницы) не должны переходить в другой тест
+    from django.core.cache import cache
+    cache.clear()
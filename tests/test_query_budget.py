@@ -0,0 +1,90 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import urls as posts_urls
+
+# Максимальное число SQL-запросов на один запрос к странице.
+# Лимиты не зависят от количества постов и комментариев на странице,
+# поэтому любой новый N+1 сразу ломает тест.
+QUERY_BUDGETS = {
+    'index': 2,
+    'follow_index': 4,
+    'profile_follow': 3,
+    'profile_unfollow': 7,
+    'groups': 3,
+    'new_post': 5,
+    'profile': 4,
+    'search': 3,
+    'post': 3,
+    'post_edit': 4,
+    'add_comment': 4,
+    'post_comments': 1,
+}
+
+
+@pytest.fixture
+def feed(user, group):
+    from posts.models import Comment, Follow, Post
+    authors = [
+        get_user_model().objects.create_user(username=f'budget_{i}')
+        for i in range(3)
+    ]
+    for author in authors:
+        Follow.objects.create(user=user, author=author)
+    posts = [
+        Post.objects.create(text=f'Пост {i}', author=authors[i % 3],
+                            group=group if i % 2 else None)
+        for i in range(12)
+    ]
+    post = Post.objects.create(text='Свой пост', author=user, group=group)
+    for i in range(5):
+        for target in (post, posts[-1]):
+            Comment.objects.create(text=f'Комментарий {i}',
+                                   author=authors[i % 3], post=target)
+    return {'author': authors[0], 'post': post}
+
+
+def budget_requests(feed, group, user):
+    post = feed['post']
+    author = feed['author'].username
+    return {
+        'index': ('get', reverse('index'), {}),
+        'follow_index': ('get', reverse('follow_index'), {}),
+        'profile_follow': ('get', reverse('profile_follow', args=[author]), {}),
+        'profile_unfollow': ('get', reverse('profile_unfollow', args=[author]), {}),
+        'groups': ('get', reverse('groups', args=[group.slug]), {}),
+        'new_post': ('post', reverse('new_post'), {'text': 'Новый пост'}),
+        'profile': ('get', reverse('profile', args=[author]), {}),
+        'search': ('get', reverse('search'), {'q': 'Пост'}),
+        'post': ('get', reverse('post', args=[user.username, post.id]), {}),
+        'post_edit': ('post', reverse('post_edit', args=[user.username, post.id]),
+                      {'text': 'Исправленный пост'}),
+        'add_comment': ('post', reverse('add_comment', args=[user.username, post.id]),
+                        {'text': 'Ещё комментарий'}),
+        'post_comments': ('get', reverse('post_comments', args=[user.username, post.id]), {}),
+    }
+
+
+class TestQueryBudget:
+
+    def test_every_url_has_budget(self):
+        names = {pattern.name for pattern in posts_urls.urlpatterns}
+        assert names == set(QUERY_BUDGETS), \
+            'Задайте лимит запросов в `QUERY_BUDGETS` для каждого имени из *posts/urls.py*'
+
+    @pytest.mark.django_db(transaction=True)
+    @pytest.mark.parametrize('name', sorted(QUERY_BUDGETS))
+    def test_query_budget(self, name, user_client, user, group, feed):
+        method, url, data = budget_requests(feed, group, user)[name]
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(user_client, method)(url, data)
+        assert response.status_code in (200, 302), \
+            f'Страница `{url}` ответила кодом {response.status_code}'
+        count = len(queries.captured_queries)
+        sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+        assert count <= QUERY_BUDGETS[name], \
+            f'Страница `{name}` выполнила {count} SQL-запросов ' \
+            f'при лимите {QUERY_BUDGETS[name]}:\n{sql}'
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+
+
+def _key(user_id):
+    return 'auth-user:%s' % user_id
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend, который берёт пользователя сессии из кэша.
+
+    AuthenticationMiddleware загружает пользователя на каждом запросе;
+    здесь он читается из кэша, а из базы — только после изменения
+    (users.signals). Хэш пароля для проверки сессии берётся из того же
+    объекта, поэтому после смены пароля старые сессии закрываются, как
+    и без кэша.
+    """
+
+    def get_user(self, user_id):
+        key = _key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+def forget(user_id):
+    """Сбрасывает пользователя; второй раз — после коммита, на случай,
+    если параллельный запрос успел загрузить старую строку."""
+    cache.delete(_key(user_id))
+    transaction.on_commit(lambda: cache.delete(_key(user_id)))
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.checks import Error, Tags, register
+
+CACHED_SESSION_ENGINES = ('django.contrib.sessions.backends.cache',
+                          'django.contrib.sessions.backends.cached_db')
+CACHED_AUTH_BACKEND = 'users.backends.CachedModelBackend'
+LOCAL_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+def _is_local(alias):
+    return settings.CACHES[alias]['BACKEND'] == LOCAL_CACHE
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_session_cache(app_configs, **kwargs):
+    """Сессии и пользователи сессий из кэша требуют общего кэша.
+
+    С кэшем в памяти процесса выход или смена пароля сбрасывают запись
+    только у воркера, который их обработал: остальные продолжают
+    пускать по старой сессии.
+    """
+    errors = []
+    if (settings.SESSION_ENGINE in CACHED_SESSION_ENGINES
+            and _is_local(settings.SESSION_CACHE_ALIAS)):
+        errors.append(Error(
+            'Сессии хранятся в кэше %r, а он в памяти одного процесса'
+            % settings.SESSION_CACHE_ALIAS,
+            hint='Настройте общий кэш (memcached) или SESSION_ENGINE = '
+                 "'django.contrib.sessions.backends.db'.",
+            id='users.E001',
+        ))
+    if (CACHED_AUTH_BACKEND in settings.AUTHENTICATION_BACKENDS
+            and _is_local(DEFAULT_CACHE_ALIAS)):
+        errors.append(Error(
+            '%s берёт пользователей из кэша в памяти одного процесса'
+            % CACHED_AUTH_BACKEND,
+            hint='Настройте общий кэш (memcached) или оставьте только '
+                 'django.contrib.auth.backends.ModelBackend.',
+            id='users.E002',
+        ))
+    return errors
@@ -0,0 +1,19 @@
+"""
+ASGI config for yatube project.
+
+Django 2.2 не умеет работать по ASGI, поэтому здесь только живые
+обновления лент (posts.live): поток server-sent events на /live/.
+Остальные адреса обслуживает WSGI-приложение, прокси отправляет сюда
+только /live/.
+
+Запуск, например: uvicorn yatube.asgi:application
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+django.setup()
+
+from posts.live import application  # noqa: E402,F401
@@ -0,0 +1,36 @@
+"""SQLite для продакшена: PRAGMA при открытии соединения и BEGIN IMMEDIATE.
+
+Настройки задаются в OPTIONS базы данных:
+
+    'OPTIONS': {
+        'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+        'transaction_mode': 'IMMEDIATE',
+    }
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # собственные опции не передаются в sqlite3.connect()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        pragmas = self.settings_dict['OPTIONS'].get('pragmas', {})
+        for name, value in pragmas.items():
+            conn.execute('PRAGMA %s = %s' % (name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # с обычным BEGIN транзакция, начавшая с чтения, не может дождаться
+        # блокировки на запись и сразу получает «database is locked»
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode:
+            self.cursor().execute('BEGIN %s' % mode)
+        else:
+            super()._start_transaction_under_autocommit()
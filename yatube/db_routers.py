@@ -0,0 +1,116 @@
+"""Чтение с реплик и запись в основную базу.
+
+Реплики перечислены в DATABASE_REPLICAS. На реплики уходят только
+чтения внутри безопасных (GET, HEAD) запросов, которые пропустил
+ReplicaMiddleware; команды, фоновые потоки и всё после первой записи
+читают из основной базы. После записи пользователь ещё
+REPLICA_PIN_SECONDS секунд читает из основной базы, чтобы сразу видеть
+свои посты и комментарии, даже если реплика отстаёт.
+
+Ответы собираются в кэши с ключами по номерам поколений из общего кэша,
+а номера меняются сразу при записи. Чтобы устаревшие строки реплики не
+попали в кэш под новым номером, реплики обслуживают запросы только
+спустя REPLICA_PIN_SECONDS после последнего коммита в основную базу:
+время коммита хранится в общем кэше, а за это время реплика успевает
+догнать основную базу.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+PIN_COOKIE = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+LAST_WRITE_KEY = 'replica:last-write'
+
+_state = threading.local()
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def replica_allowed():
+    return getattr(_state, 'replica_allowed', False)
+
+
+@contextmanager
+def allow_replica(allowed=True):
+    previous = replica_allowed()
+    _state.replica_allowed = allowed
+    _state.wrote = False
+    try:
+        yield
+    finally:
+        _state.replica_allowed = previous
+
+
+def wrote():
+    return getattr(_state, 'wrote', False)
+
+
+def _mark_write():
+    cache.set(LAST_WRITE_KEY, time.time(), timeout=None)
+
+
+def replicas_fresh():
+    """Успели ли реплики получить все коммиты основной базы."""
+    now = time.time()
+    last_write = cache.get(LAST_WRITE_KEY)
+    if last_write is None:
+        # после очистки кэша неизвестно, когда была запись: отсчёт с нуля
+        cache.add(LAST_WRITE_KEY, now, timeout=None)
+        last_write = cache.get(LAST_WRITE_KEY, now)
+    return now - last_write >= settings.REPLICA_PIN_SECONDS
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if aliases and replica_allowed():
+            return random.choice(aliases)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # дальше в этом запросе читаем свою же запись из основной базы
+        _state.replica_allowed = False
+        _state.wrote = True
+        if replicas():
+            # отставание реплики отсчитывается от коммита
+            transaction.on_commit(_mark_write)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # реплики получают схему копированием основной базы
+        if db in replicas():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        allowed = (request.method in SAFE_METHODS
+                   and PIN_COOKIE not in request.COOKIES
+                   and bool(replicas()) and replicas_fresh())
+        with allow_replica(allowed):
+            response = self.get_response(request)
+            if wrote():
+                response.set_cookie(
+                    PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                    httponly=True)
+        return response
@@ -0,0 +1,225 @@
+"""Метрики запросов в формате Prometheus и журнал медленных запросов.
+
+MetricsMiddleware для каждого имени адреса из posts/urls.py и
+users/urls.py записывает в гистограммы время ответа, число и суммарное
+время SQL-запросов и время рендеринга шаблонов. Гистограммы живут в
+памяти процесса, поэтому каждый процесс отдаёт на /metrics/ свои
+значения.
+
+Часть запросов (SLOW_REQUEST_SAMPLE_RATE) дополнительно запоминает текст
+SQL; если такой запрос оказался дольше SLOW_REQUEST_SECONDS, он вместе
+с SQL пишется в журнал yatube.slow_requests.
+"""
+import bisect
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+from django.template.backends.django import Template as BackendTemplate
+from django.utils.crypto import constant_time_compare
+
+slow_log = logging.getLogger('yatube.slow_requests')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+# адреса, для которых собираются метрики
+URLCONFS = ('posts.urls', 'users.urls')
+
+_local = threading.local()
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин по меткам."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [
+                    [0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text),
+                 '# TYPE %s histogram' % self.name]
+        with self.lock:
+            series = {label: (list(counts), total, count)
+                      for label, (counts, total, count) in self.series.items()}
+        for label, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                lines.append('%s_bucket{view="%s",le="%s"} %d' % (
+                    self.name, label, bound, cumulative))
+            lines.append('%s_sum{view="%s"} %s' % (self.name, label, total))
+            lines.append('%s_count{view="%s"} %d' % (self.name, label, count))
+        return lines
+
+    def reset(self):
+        with self.lock:
+            self.series.clear()
+
+
+REQUEST_SECONDS = Histogram(
+    'yatube_request_seconds', 'Время ответа', SECONDS_BUCKETS)
+DB_QUERIES = Histogram(
+    'yatube_db_queries', 'SQL-запросов на один ответ', QUERIES_BUCKETS)
+DB_SECONDS = Histogram(
+    'yatube_db_seconds', 'Время SQL-запросов на один ответ', SECONDS_BUCKETS)
+TEMPLATE_SECONDS = Histogram(
+    'yatube_template_seconds', 'Время рендеринга шаблонов на один ответ',
+    SECONDS_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, TEMPLATE_SECONDS)
+# время шагов запуска процесса, заполняет yatube.warmup
+STARTUP_SECONDS = {}
+
+
+class RequestStats:
+
+    def __init__(self, keep_sql):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.sql = [] if keep_sql else None
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper для всех соединений на время запроса
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            if self.sql is not None:
+                self.sql.append((elapsed, sql))
+
+
+_view_names = None
+
+
+def view_names():
+    global _view_names
+    if _view_names is None:
+        from importlib import import_module
+        _view_names = frozenset(
+            pattern.name
+            for urlconf in URLCONFS
+            for pattern in import_module(urlconf).urlpatterns
+            if pattern.name)
+    return _view_names
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        keep_sql = random.random() < settings.SLOW_REQUEST_SAMPLE_RATE
+        stats = _local.stats = RequestStats(keep_sql)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        if match is not None and match.url_name in view_names():
+            self.record(match.url_name, elapsed, stats)
+            if elapsed >= settings.SLOW_REQUEST_SECONDS and keep_sql:
+                self.log_slow(request, match.url_name, elapsed, stats)
+        return response
+
+    def record(self, name, elapsed, stats):
+        REQUEST_SECONDS.observe(name, elapsed)
+        DB_QUERIES.observe(name, stats.queries)
+        DB_SECONDS.observe(name, stats.db_seconds)
+        TEMPLATE_SECONDS.observe(name, stats.template_seconds)
+
+    def log_slow(self, request, name, elapsed, stats):
+        lines = ['%s %s [%s] %.3f с, SQL: %d за %.3f с, шаблоны %.3f с' % (
+            request.method, request.get_full_path(), name, elapsed,
+            stats.queries, stats.db_seconds, stats.template_seconds)]
+        lines.extend('  %.4f %s' % (seconds, sql)
+                     for seconds, sql in stats.sql)
+        slow_log.warning('\n'.join(lines))
+
+
+class InstrumentedTemplate(BackendTemplate):
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats = getattr(_local, 'stats', None)
+            if stats is not None:
+                stats.template_seconds += time.perf_counter() - started
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """Шаблоны Django, замеряющие время рендеринга страницы.
+
+    Вложенные include рендерятся внутри шаблона страницы и отдельно не
+    считаются.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code),
+                                    self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
+
+
+def metrics_allowed(request):
+    """Можно ли отдать метрики.
+
+    С METRICS_TOKEN нужен заголовок «Authorization: Bearer <токен>».
+    Без него пускаются адреса METRICS_ALLOWED_IPS, но только напрямую:
+    за обратным прокси REMOTE_ADDR — адрес самого прокси, поэтому
+    запросы с X-Forwarded-For отклоняются.
+    """
+    if settings.METRICS_TOKEN:
+        return constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''),
+            'Bearer %s' % settings.METRICS_TOKEN)
+    return ('HTTP_X_FORWARDED_FOR' not in request.META
+            and request.META.get('REMOTE_ADDR')
+            in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    if STARTUP_SECONDS:
+        lines.extend(['# HELP yatube_startup_seconds Время запуска процесса',
+                      '# TYPE yatube_startup_seconds gauge'])
+        lines.extend('yatube_startup_seconds{step="%s"} %s' % item
+                     for item in sorted(STARTUP_SECONDS.items()))
+    return HttpResponse('\n'.join(lines) + '\n',
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
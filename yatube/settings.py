@@ -60,28 +60,35 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'sorl.thumbnail',
-    'debug_toolbar',
 ]
 
 # Идентификатор текущего сайта
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.db_routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'posts.middleware.AnonymousPageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# панель отладки только для разработки
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # DjangoTemplates с замером времени рендеринга (yatube.metrics)
+        "BACKEND": "yatube.metrics.InstrumentedTemplates",
         "DIRS": [TEMPLATES_DIR],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -109,6 +116,29 @@ DATABASES = {
     }
 }
 
+DATABASE_ROUTERS = ['yatube.db_routers.ReplicaRouter']
+# псевдонимы реплик только для чтения (см. yatube/settings_replica.py)
+DATABASE_REPLICAS = []
+# на сколько секунд реплика может отстать: столько после записи
+# пользователь читает из основной базы, и столько же после любого коммита
+# реплики не обслуживают запросы
+REPLICA_PIN_SECONDS = 5
+
+
+# Сессии читаются из кэша, а в базу только пишутся, чтобы переживать
+# перезапуск кэша; пользователь сессии тоже берётся из кэша
+# (users.backends). ModelBackend оставлен для сессий, созданных до
+# кэширования: в них записан его путь. Кэш при этом должен быть общим для
+# всех процессов (проверка users.E001/E002 в manage.py check --deploy).
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = [
+    'users.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# сколько секунд пользователь живёт в кэше, если его изменили в обход
+# сигналов (queryset.update())
+USER_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -155,3 +185,70 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 INTERNAL_IPS = [
     '127.0.0.1',
 ] 
+
+# Лента подписок: новые посты раскладываются по лентам подписчиков при
+# записи. Посты авторов, у которых подписчиков больше лимита, не
+# раскладываются, а подмешиваются в ленту при чтении.
+TIMELINE_FANOUT_LIMIT = 1000
+# сколько последних постов автора добавлять в ленту при подписке
+TIMELINE_BACKFILL_SIZE = 200
+
+# Миниатюры для лент создаются в фоне локальным пулом потоков;
+# 0 — создавать сразу после коммита в том же потоке
+THUMBNAIL_WORKERS = 2
+
+# Кэш целых страниц для гостей (posts.middleware): какие страницы
+# кэшировать, сколько секунд копия свежа и сколько ещё её можно отдавать
+# устаревшей, пока другой запрос строит новую
+PAGE_CACHE_URLS = ('index', 'groups', 'profile')
+PAGE_CACHE_TIMEOUT = 30
+PAGE_CACHE_STALE_TIMEOUT = 300
+# чем больше, тем раньше перестраиваются популярные страницы
+PAGE_CACHE_BETA = 1.0
+
+# Живые обновления лент (yatube.asgi): как часто процесс ASGI проверяет
+# кэш и как часто шлёт клиентам пустое событие, чтобы соединение не
+# закрыли прокси
+LIVE_POLL_INTERVAL = 1
+LIVE_HEARTBEAT = 15
+
+# Метрики запросов (yatube.metrics): кто может читать /metrics/ (токен
+# или прямые запросы с адресов списка), какие запросы считать медленными
+# и какая доля запросов запоминает свой SQL для журнала медленных запросов
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = ['127.0.0.1']
+SLOW_REQUEST_SECONDS = 0.5
+SLOW_REQUEST_SAMPLE_RATE = 0.1
+
+# Прогрев воркера при запуске (yatube.warmup): включать ли его и какие
+# страницы запросить заранее
+WARMUP_ON_START = False
+WARMUP_URLS = ('index',)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'slow_requests': {
+            'class': 'logging.FileHandler',
+            'filename': os.path.join(BASE_DIR, 'slow_requests.log'),
+            # файл появится только с первой записью
+            'delay': True,
+        },
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'yatube.slow_requests': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+        'yatube.startup': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,68 @@
+"""Настройки для продакшена поверх yatube.settings.
+
+Запуск: DJANGO_SETTINGS_MODULE=yatube.settings_production
+"""
+import os
+from copy import deepcopy
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES, INSTALLED_APPS, MIDDLEWARE, TEMPLATES
+
+DEBUG = False
+
+# yatube.settings подключает панель отладки, пока DEBUG ещё True
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app != 'debug_toolbar']
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+              if not middleware.startswith('debug_toolbar.')]
+
+# шаблоны компилируются один раз на процесс; копия, чтобы не менять
+# словари из yatube.settings
+TEMPLATES = deepcopy(TEMPLATES)
+TEMPLATES[0]['APP_DIRS'] = False
+TEMPLATES[0]['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
+
+# Кэш общий для всех воркеров: номера поколений, сессии, пользователи
+# сессий и кэш страниц должны сбрасываться во всех процессах сразу.
+# Адреса серверов memcached — через запятую.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': os.environ.get('YATUBE_MEMCACHED',
+                                   '127.0.0.1:11211').split(','),
+    }
+}
+
+# воркер прогревается до первого запроса (yatube.warmup)
+WARMUP_ON_START = True
+
+# за обратным прокси все запросы приходят с его адреса, поэтому /metrics/
+# отдаётся только по токену
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN')
+METRICS_ALLOWED_IPS = []
+
+# SQLite в режиме WAL: читатели не ждут писателей, а писатели — читателей.
+# Соединения живут между запросами, PRAGMA выставляются при открытии.
+DATABASES = deepcopy(DATABASES)
+DATABASES['default'].update({
+    'ENGINE': 'yatube.db_backends.sqlite3',
+    'CONN_MAX_AGE': 600,
+    'OPTIONS': {
+        'timeout': 5,
+        'transaction_mode': 'IMMEDIATE',
+        'pragmas': {
+            'journal_mode': 'WAL',
+            # в режиме WAL NORMAL не теряет целостность, только последние
+            # транзакции при отключении питания
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'cache_size': -64000,
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+        },
+    },
+})
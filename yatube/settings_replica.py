@@ -0,0 +1,21 @@
+"""Локальная проверка чтения с реплики.
+
+Вторая база SQLite изображает реплику: перед запуском скопируйте
+db.sqlite3 в db_replica.sqlite3. Новые записи в реплику не попадают,
+поэтому хорошо видно, какие чтения ушли на неё, а какие — в основную
+базу.
+
+Запуск: DJANGO_SETTINGS_MODULE=yatube.settings_replica
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+    # в тестах реплика — то же соединение, что и основная база
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_REPLICAS = ['replica']
@@ -15,11 +15,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
-from django.contrib.flatpages import views as vs
+from posts import views as vs
 from django.conf.urls import handler404, handler500
 from django.conf import settings
 from django.conf.urls.static import static
 
+from yatube.metrics import metrics_view
+
 
 
 handler404 = "posts.views.page_not_found"  # noqa
@@ -46,6 +48,10 @@ urlpatterns = [
         vs.flatpage,
         {'url': '/about-spec/'},
         name='about-spec'),
+    # метрики для Prometheus
+    path('metrics/', metrics_view, name='metrics'),
+    # JSON для мобильных клиентов
+    path('api/', include('posts.api_urls')),
     # импорт из приложения posts
     path('', include('posts.urls')),
 ]
@@ -0,0 +1,157 @@
+"""Прогрев воркера до того, как он начнёт принимать запросы.
+
+Без прогрева первые запросы после запуска собирают резолвер адресов,
+компилируют шаблоны, загружают переводы и наполняют кэши, поэтому после
+каждого деплоя время ответа подскакивает. warm_up() делает всё это
+заранее и запоминает, сколько занял каждый шаг: время видно в журнале
+yatube.startup и на /metrics/.
+"""
+import logging
+import os
+import time
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist, engines
+from django.urls import get_resolver, reverse
+from django.utils import translation
+from django.utils.encoding import iri_to_uri
+
+from posts import generations, reference
+from posts.middleware import BYPASS_ENVIRON_KEY
+
+from . import metrics
+
+logger = logging.getLogger('yatube.startup')
+
+
+def template_dirs(engine):
+    """Каталоги DIRS и templates/ приложений самого проекта."""
+    dirs = list(engine.dirs)
+    for app in apps.get_app_configs():
+        directory = os.path.join(app.path, 'templates')
+        # шаблоны админки и сторонних пакетов прогревать незачем
+        if app.path.startswith(settings.BASE_DIR) and os.path.isdir(directory):
+            dirs.append(directory)
+    return dirs
+
+
+def compile_templates():
+    """Компилирует все шаблоны проекта.
+
+    С кэширующим загрузчиком скомпилированные шаблоны остаются в памяти.
+    """
+    total = 0
+    for engine in engines.all():
+        for directory in template_dirs(engine):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if not name.endswith('.html'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        engine.get_template(os.path.relpath(path, directory))
+                    except TemplateDoesNotExist:
+                        # загрузчики движка не смотрят в этот каталог
+                        continue
+                    total += 1
+    return total
+
+
+def _compile_patterns(patterns):
+    total = 0
+    for pattern in patterns:
+        # регулярные выражения компилируются лениво при первом обращении
+        pattern.pattern.regex
+        total += 1
+        if hasattr(pattern, 'url_patterns'):
+            total += _compile_patterns(pattern.url_patterns)
+    return total
+
+
+def resolve_urls():
+    """Строит резолвер: регулярные выражения и словарь для reverse()."""
+    resolver = get_resolver()
+    resolver.reverse_dict
+    return _compile_patterns(resolver.url_patterns)
+
+
+def load_translations():
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.deactivate()
+
+
+def preload_caches():
+    reference.preload()
+    generations.get(generations.FEED)
+    generations.get(generations.PAGES)
+
+
+def call(application, path):
+    """Один гостевой запрос через WSGI-приложение, как от сервера.
+
+    Кэш целых страниц запрос обходит: копия, сохранённая под служебным
+    адресом 127.0.0.1, настоящим посетителям не досталась бы.
+    """
+    path, _, query = path.partition('?')
+    # по PEP 3333 строки окружения — байты UTF-8, прочитанные как latin-1
+    environ = {'PATH_INFO': path.encode().decode('iso-8859-1'),
+               'QUERY_STRING': iri_to_uri(query),
+               'wsgi.input': BytesIO(),
+               BYPASS_ENVIRON_KEY: True}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ,
+                           lambda status, headers: statuses.append(status))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return statuses[0]
+
+
+def request_pages(application):
+    """Проводит запросы к WARMUP_URLS через всё приложение.
+
+    Заодно прогреваются промежуточные слои и кэш фрагментов.
+    """
+    for name in settings.WARMUP_URLS:
+        call(application, reverse(name))
+    # прогревочные запросы не должны попадать в метрики
+    for histogram in metrics.HISTOGRAMS:
+        histogram.reset()
+
+
+def warm_up(application=None, started=None):
+    """Прогревает процесс и возвращает время каждого шага в секундах.
+
+    started — time.perf_counter() в начале запуска процесса; если он
+    задан, в результат попадает и время от запуска до готовности.
+    """
+    steps = [('templates', compile_templates), ('urls', resolve_urls),
+             ('translations', load_translations), ('caches', preload_caches)]
+    if application is not None:
+        steps.append(('pages', lambda: request_pages(application)))
+    timings = {}
+    if started is not None:
+        timings['setup'] = time.perf_counter() - started
+    for name, step in steps:
+        step_started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            # недопрогретый воркер всё равно лучше, чем не запустившийся
+            logger.exception('Прогрев: шаг %s не выполнен', name)
+        timings[name] = time.perf_counter() - step_started
+    if started is not None:
+        timings['total'] = time.perf_counter() - started
+    # соединения не должны пережить fork() при gunicorn --preload
+    connections.close_all()
+    metrics.STARTUP_SECONDS.update(timings)
+    logger.info('Прогрев: %s', ', '.join(
+        '%s %.3f с' % item for item in timings.items()))
+    return timings